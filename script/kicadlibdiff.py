@@ -0,0 +1,224 @@
+#!/usr/bin/env python3
+"""Symbol by symbol comparison of two generations of the kicad symbol libraries.
+
+Compares two library files, or all libraries of two directories, and reports the parts that were added or removed
+and for every part present in both: added and removed pins, changed pin names, electrical types, alternate
+functions and alternate function types, changed properties such as the footprint and, unless --no-geometry is
+given, moved pins and resized unit frames. Derived symbols are compared with the pins of their parent symbol. Symbols whose text did not change are
+not parsed at all, see kicadlibreader.py.
+
+Exits with 0 if the libraries are equivalent, 1 if they differ and 2 on errors, like diff.
+"""
+
+__author__ = 'esdentem'
+
+import argparse
+import glob
+import json
+import os
+import sys
+
+from kicadlibreader import SymbolLibrary, sexpr_child, sexpr_children
+
+
+def symbol_model(lib, name, body_models):
+    """Properties, pins by number and unit frames of a symbol.
+
+    A derived symbol has its own properties and the pins and frames of its parent. body_models keeps the pins and
+    frames of the parents that were already parsed.
+    """
+    expr = lib.symbol(name)
+    properties = {prop[1]: prop[2] for prop in sexpr_children(expr, 'property')}
+
+    parent = lib.extends(name)
+    if parent is None:
+        return {'properties': properties, **symbol_body(name, expr)}
+
+    if parent not in body_models:
+        if parent not in lib:
+            raise ValueError(f"'{name}' extends '{parent}', which is not in '{lib.filename}'")
+        body_models[parent] = symbol_body(parent, lib.symbol(parent))
+    return {'properties': properties, **body_models[parent]}
+
+
+def symbol_body(name, expr):
+    # The units are named NAME_<unit>_<body style>
+    pins = {}
+    frames = {}
+    for unit_expr in sexpr_children(expr, 'symbol'):
+        unit = unit_expr[1][len(name) + 1:].split('_')[0]
+        for rect in sexpr_children(unit_expr, 'rectangle'):
+            frames[unit] = tuple(sexpr_child(rect, 'start')[1:]) + tuple(sexpr_child(rect, 'end')[1:])
+        for pin in sexpr_children(unit_expr, 'pin'):
+            pin_name = sexpr_child(pin, 'name')[1]
+            prefix = pin_name + "/"
+            # Alternate name to its electrical type
+            alternates = {alt[1][len(prefix):] if alt[1].startswith(prefix) else alt[1]: alt[2]
+                          for alt in sexpr_children(pin, 'alternate')}
+            pins[sexpr_child(pin, 'number')[1]] = {'name': pin_name,
+                                                   'type': pin[1],
+                                                   'alternates': alternates,
+                                                   'position': (unit, *sexpr_child(pin, 'at')[1:])}
+    return {'pins': pins, 'frames': frames}
+
+
+def format_position(position):
+    return f"unit {position[0]} ({' '.join(position[1:])})"
+
+
+def diff_symbol(old, new, geometry=True):
+    """Human readable list of the differences between two symbol models."""
+    changes = []
+
+    for key in sorted(old['properties'].keys() | new['properties'].keys()):
+        old_value = old['properties'].get(key)
+        new_value = new['properties'].get(key)
+        if old_value != new_value and key != "Value":
+            changes.append(f"property {key}: {old_value!r} -> {new_value!r}")
+
+    old_pins = old['pins']
+    new_pins = new['pins']
+    # Pin numbers are strings like 12 or A3, sort them by length first so 9 comes before 10
+    for number in sorted(old_pins.keys() | new_pins.keys(), key=lambda number: (len(number), number)):
+        old_pin = old_pins.get(number)
+        new_pin = new_pins.get(number)
+        if new_pin is None:
+            changes.append(f"pin {number}: removed {old_pin['name']}")
+            continue
+        if old_pin is None:
+            changes.append(f"pin {number}: added {new_pin['name']}")
+            continue
+        if old_pin['name'] != new_pin['name']:
+            changes.append(f"pin {number}: renamed {old_pin['name']} -> {new_pin['name']}")
+        if old_pin['type'] != new_pin['type']:
+            changes.append(f"pin {number} {new_pin['name']}: type {old_pin['type']} -> {new_pin['type']}")
+        added = [alt for alt in new_pin['alternates'] if alt not in old_pin['alternates']]
+        removed = [alt for alt in old_pin['alternates'] if alt not in new_pin['alternates']]
+        if added or removed:
+            changes.append(f"pin {number} {new_pin['name']}: alternates "
+                           + " ".join(["+" + alt for alt in added] + ["-" + alt for alt in removed]))
+        for alt, alt_type in new_pin['alternates'].items():
+            old_type = old_pin['alternates'].get(alt)
+            if old_type is not None and old_type != alt_type:
+                changes.append(f"pin {number} {new_pin['name']}: alternate {alt} type {old_type} -> {alt_type}")
+        if geometry and old_pin['position'] != new_pin['position']:
+            changes.append(f"pin {number} {new_pin['name']}: moved {format_position(old_pin['position'])} -> "
+                           f"{format_position(new_pin['position'])}")
+
+    if geometry:
+        for unit in sorted(old['frames'].keys() | new['frames'].keys()):
+            old_frame = old['frames'].get(unit)
+            new_frame = new['frames'].get(unit)
+            if old_frame is None:
+                changes.append(f"unit {unit}: added")
+            elif new_frame is None:
+                changes.append(f"unit {unit}: removed")
+            elif old_frame != new_frame:
+                changes.append(f"unit {unit}: frame ({' '.join(old_frame)}) -> ({' '.join(new_frame)})")
+
+    return changes
+
+
+def unchanged(old_lib, new_lib, name):
+    # The same text, and for derived symbols the same parent text, means the same symbol
+    if old_lib.raw(name) != new_lib.raw(name):
+        return False
+    parent = old_lib.extends(name)
+    if parent is None:
+        return True
+    return parent in old_lib and parent in new_lib and old_lib.raw(parent) == new_lib.raw(parent)
+
+
+def diff_library(old_filename, new_filename, geometry=True):
+    """Added and removed symbol names and the changes of every changed symbol, see diff_symbol."""
+    with SymbolLibrary(old_filename) as old_lib, SymbolLibrary(new_filename) as new_lib:
+        old_names = set(old_lib.index)
+        new_names = set(new_lib.index)
+        result = {'added': [name for name in new_lib.index if name not in old_names],
+                  'removed': [name for name in old_lib.index if name not in new_names],
+                  'changed': {}}
+
+        old_bodies = {}
+        new_bodies = {}
+        for name in new_lib.index:
+            if name not in old_names or unchanged(old_lib, new_lib, name):
+                continue
+            changes = diff_symbol(symbol_model(old_lib, name, old_bodies), symbol_model(new_lib, name, new_bodies),
+                                  geometry)
+            if changes:
+                result['changed'][name] = changes
+
+    return result
+
+
+def library_pairs(old, new):
+    # Two files are one pair, two directories are paired by library file name. A library that is only in one of
+    # the directories is paired with None.
+    if not os.path.isdir(old) and not os.path.isdir(new):
+        return {os.path.basename(new): (old, new)}
+    if not (os.path.isdir(old) and os.path.isdir(new)):
+        raise ValueError("compare two library files or two directories")
+
+    names = {os.path.basename(f) for d in (old, new) for f in glob.glob(os.path.join(d, "*.kicad_sym"))}
+    pairs = {}
+    for name in sorted(names):
+        old_filename = os.path.join(old, name)
+        new_filename = os.path.join(new, name)
+        pairs[name] = (old_filename if os.path.exists(old_filename) else None,
+                       new_filename if os.path.exists(new_filename) else None)
+    return pairs
+
+
+def diff(old, new, geometry=True):
+    """Library name to its differences, see diff_library, or to 'added' or 'removed' for whole libraries."""
+    results = {}
+    for lib_name, (old_filename, new_filename) in library_pairs(old, new).items():
+        if old_filename is None:
+            results[lib_name] = 'added'
+        elif new_filename is None:
+            results[lib_name] = 'removed'
+        else:
+            result = diff_library(old_filename, new_filename, geometry)
+            if result['added'] or result['removed'] or result['changed']:
+                results[lib_name] = result
+    return results
+
+
+def print_diff(results):
+    for lib_name, result in results.items():
+        if isinstance(result, str):
+            print(f"{lib_name}: library {result}")
+            continue
+        print(f"{lib_name}: {len(result['added'])} added, {len(result['removed'])} removed, "
+              f"{len(result['changed'])} changed")
+        for name in result['added']:
+            print(f"  + {name}")
+        for name in result['removed']:
+            print(f"  - {name}")
+        for name, changes in result['changed'].items():
+            print(f"  ~ {name}")
+            for change in changes:
+                print(f"      {change}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('old', help="old library file or directory of libraries")
+    parser.add_argument('new', help="new library file or directory of libraries")
+    parser.add_argument('--no-geometry', dest='geometry', action='store_false',
+                        help="ignore moved pins and resized unit frames")
+    parser.add_argument('--json', action='store_true', help="print the differences as json")
+    args = parser.parse_args()
+
+    try:
+        results = diff(args.old, args.new, args.geometry)
+    except (OSError, ValueError) as e:
+        print(e, file=sys.stderr)
+        sys.exit(2)
+
+    if args.json:
+        print(json.dumps(results, indent=2))
+    else:
+        print_diff(results)
+
+    sys.exit(1 if results else 0)
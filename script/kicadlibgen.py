@@ -5,8 +5,25 @@ __author__ = 'esdentem'
 
 import xml.etree.ElementTree
 import re
+import fnmatch
 import sys
 import glob
+import io
+import os
+import argparse
+import multiprocessing
+import functools
+import hashlib
+import json
+import collections
+import csv
+import cProfile
+import time
+import logging
+import inspect
+import sqlite3
+
+import stm32pindb
 
 glyph_widths = {
     ' ': 38, '!': 24, '"': 38, '#': 50, '$': 48, '%': 57, '&': 62, '\'': 24, '(': 33, ')': 33, '*': 38, '+': 62,
@@ -21,13 +38,127 @@ glyph_widths = {
 
 alt_symbol_width = 70
 
+# Characters missing from glyph_widths are measured as wide as the widest known glyph, so the text still fits
+missing_glyph_width = max(glyph_widths.values())
+
+# Characters missing from glyph_widths, reported once at the end of a run
+missing_glyphs = set()
+
+# Pin types are:
+# Input             I
+# Output            O
+# Bidirectional     B
+# Tristate          T
+# Passive           P
+# Unspecified       U
+# Power In          W
+# Power out         w
+# Open Collector    C
+# Open Emitter      E
+# Not Connected     N
+# stm32cube pin type to KiCad electrical pin type, types missing here default to bidirectional
+pin_types = {
+    'I/O': 'bidirectional', 'MonoIO': 'bidirectional',
+    'I': 'input', 'Boot': 'input', 'Reset': 'input',
+    'O': 'output',
+    'S': 'power_in', 'Power': 'power_in',
+    'NC': 'no_connect',
+    'Passive': 'passive',
+}
+default_pin_type = 'bidirectional'
+
+# Pin side to KiCad pin orientation in degrees
+pin_directions = {'L': 180, 'R': 0, 'U': 90, 'D': 270}
+
+# Source pin types to the pin type letters of the legacy EESchema library format, anything else is bidirectional
+legacy_pin_types = {
+    'I/O': 'B',
+    'MonoIO': 'B',
+    'I': 'I',
+    'Boot': 'I',
+    'Reset': 'I',
+    'O': 'O',
+    'S': 'W',
+    'Power': 'W',
+    'NC': 'N',
+    'Passive': 'P',
+}
+
+# Package code letter in the part number (the letter in front of the trailing temperature range 'x' of the source
+# filename) to the package names it stands for. Used to skip source files by their name alone when only some
+# packages are generated, letters missing here are never skipped that way.
+package_code_letters = {
+    'T': ('LQFP',),
+    'U': ('UFQFPN', 'VFQFPN'),
+    'P': ('TSSOP',),
+    'Y': ('WLCSP',),
+    'H': ('TFBGA', 'UFBGA', 'LFBGA', 'VFBGA'),
+    'K': ('UFBGA', 'TFBGA'),
+    'I': ('UFBGA', 'TFBGA'),
+}
+
+
+# Quiet by default, main sets the level from --verbose and --quiet
+log = logging.getLogger("kicadlibgen")
+
+
+class GeneratorError(Exception):
+    """A source file or library file could not be read or written."""
+
+
+# Bump when the generated output changes, this also invalidates all symbol cache entries
+generator_version = "1.0"
+
+# The phases and counters of every source file in the --profile report
+profile_phases = ('cache', 'read', 'parse', 'merge', 'layout', 'render', 'write')
+profile_counters = ('pins', 'merged_pins', 'alternates')
+
+# Length of the shard name taken from the start of the part names, see source_filename_groups
+shard_name_lengths = {'family': len("STM32F"), 'subfamily': len("STM32F4"), 'line': len("STM32F405")}
+
+# Symbol layouts of the most recently rendered pinouts by fingerprint, see cached_symbol_layout
+layout_cache = collections.OrderedDict()
+layout_cache_size = 256
+layout_cache_stats = collections.Counter()
+
+class Pin:
+    """One pin of a part: its position in the package, its name, its alternate functions and its io type.
+
+    The names are interned, the same pin and signal names show up in thousands of parts. The functions are a list
+    while the pin can still be merged with other pins at the same position and a tuple after that.
+    """
+    __slots__ = ('number', 'name', 'functions', 'io_type')
+
+    def __init__(self, number, name, functions, io_type):
+        self.number = number
+        self.name = name
+        self.functions = functions
+        self.io_type = io_type
+
+    def __eq__(self, other):
+        if not isinstance(other, Pin):
+            return NotImplemented
+        return (self.number == other.number and self.name == other.name
+                and tuple(self.functions) == tuple(other.functions) and self.io_type == other.io_type)
+
+    __hash__ = None
+
+    def __repr__(self):
+        return f"Pin({self.number!r}, {self.name!r}, {tuple(self.functions)!r}, {self.io_type!r})"
+
+
+def fresh_pins(pins):
+    # Mergeable copies of pins, the merge modifies the pin records in place and turns their functions into tuples
+    return [Pin(pin.number, pin.name, list(pin.functions), pin.io_type) for pin in pins]
+
+
 def pretty_print_banks(banks):
     bank_names = sorted(banks.keys())
     for bank in bank_names:
         print("Bank: %s" % bank)
         print("\tPin\tName\tType\tFunc")
         for pin in banks[bank]:
-            print(f"\t{pin['Pin']}\t{pin['Pin_name']}\t{pin['Pin_type']}\t{pin['Pin_functions']}")
+            print(f"\t{pin.number}\t{pin.name}\t{pin.io_type}\t{pin.functions}")
 
 
 def lib_head(f):
@@ -35,8 +166,8 @@ def lib_head(f):
 (kicad_symbol_lib
     (version 20241209)
     (generator "stm32_pkl_generator")
-    (generator_version "1.0")
-""")
+    (generator_version "{generator_version}")
+""".format(generator_version=generator_version))
 
 
 def lib_foot(f):
@@ -57,7 +188,21 @@ def symbol_head(f, names, footprint, parts=1):
 		(property "Description" "" (at 0 0 0) (effects (hide yes)))
 """)
     if len(names) > 1:
-        print(f"Ignoring aliasses :( {names[1:]}")
+        log.debug("Ignoring aliasses :( %s", names[1:])
+
+def derived_symbol(f, name, parent, footprint):
+    # A part with the same pinout as an earlier part in the library only carries its own properties, KiCad takes
+    # the units and pins from the parent symbol
+    f.write(f"""\
+    (symbol \"{name}\"
+        (extends "{parent}")
+		(property "Reference" "U" (at 0 2.54 0))
+		(property "Value" "{name}" (at 0 -2.54 0))
+		(property "Footprint" "{footprint}" (at 0 -5.08 0))
+		(property "Datasheet" "" (at 0 0 0) (effects (hide yes)))
+		(property "Description" "" (at 0 0 0) (effects (hide yes)))
+    )
+""")
 
 def symbol_foot(f):
     f.write("""\
@@ -87,65 +232,22 @@ def symbol_frame(f, startx, starty, endx, endy, part=1):
 
 
 def symbol_pin(f, name, functions, num, x, y, direction, io_type, part=1):
-    pin_type = 'bidirectional'
-    # Pin types are:
-    # Input             I
-    # Output            O
-    # Bidirectional     B
-    # Tristate          T
-    # Passive           P
-    # Unspecified       U
-    # Power In          W
-    # Power out         w
-    # Open Collector    C
-    # Open Emitter      E
-    # Not Connected     N
-    if io_type:
-        if re.match("^I/O$", io_type) or \
-           re.match("^MonoIO$", io_type):
-            pin_type = 'bidirectional'
-        elif re.match("^I$", io_type) or \
-            re.match("^Boot$", io_type) or \
-            re.match("^Reset$", io_type):
-            pin_type = 'input'
-        elif re.match("^O$", io_type):
-            pin_type = 'output'
-        elif re.match("^S$", io_type) or \
-            re.match("^Power$", io_type):
-            pin_type = 'power_in'
-        elif re.match("^NC$", io_type):
-            pin_type = 'no_connect'
-        elif re.match("^Passive$", io_type):
-            pin_type = 'passive'
-        else:
-            print("Pin '%s' does not have a valid type '%s' defaulting to bidirectional 'B'." % (name, io_type))
-    else:
-        print("Pin '%s' io type is empty, defaulting to bidirectional 'B'." % name)
+    pin_type = pin_types.get(io_type, default_pin_type)
 
-    if direction == 'L':
-        direction = 180
-    elif direction == 'R':
-        direction = 0
-    elif direction == 'U':
-        direction = 90
-    elif direction == 'D':
-        direction = 270
+    direction = pin_directions.get(direction, direction)
 
     pin_name = name
+    # The whole pin including all of its alternates goes out in a single write
+    alternates = "".join([f"""\
+                (alternate "{name}/{func}" bidirectional line)
+""" for func in functions])
     f.write(f"""\
             (pin {pin_type} line
 				(at {x*0.0254:g} {y*0.0254:g} {direction})
 				(length {300*0.0254:g})
 				(name "{pin_name}")
 				(number "{num}")
-""")
-
-    for func in functions:
-        f.write(f"""\
-                (alternate "{name}/{func}" bidirectional line)
-""")
-
-    f.write("""\
+{alternates}\
             )
 """)
 
@@ -182,22 +284,24 @@ def symbol_bank_text(f, x, y, name):
 """)
 
 
-def symbol_bank(f, pins, x_offset, y_offset, spacing, direction, part=1):
+def bank_pin_positions(pins, x_offset, y_offset, spacing, direction):
+    # The pins of a bank sorted by name, each with its position
+    positions = []
     counter = 0
 
     def pin_sort_key(pin_key):
-        m = re.match("(\D*)(\d*)", pin_key['Pin_name'])
+        m = re.match("(\D*)(\d*)", pin_key.name)
         return '{}{:0>3}'.format(m.group(1), m.group(2))
 
     for pin in sorted(pins, key=pin_sort_key):
-        if direction == 'R' or direction == 'L':
-            symbol_pin(f, pin['Pin_name'], pin['Pin_functions'], pin['Pin'], x_offset, y_offset - (counter * spacing), direction, pin['Pin_type'], part)
-        elif direction == 'U' or direction == 'D':
-            symbol_pin(f, pin['Pin_name'], pin['Pin_functions'], pin['Pin'], x_offset, y_offset - (counter * spacing), direction, pin['Pin_type'], part)
+        if direction in pin_directions:
+            positions.append((pin, x_offset, y_offset - (counter * spacing), direction))
         else:
-            print("Unknown direction!!!")
+            log.warning("Unknown direction %r!!!", direction)
         counter += 1
 
+    return positions
+
 
 def symbol_pin_height(banks):
     left_banks = []
@@ -223,28 +327,31 @@ def symbol_pin_height(banks):
     return full_height * 100
 
 
+# The same pin and signal names show up in thousands of symbols, so their widths are only computed once
+@functools.lru_cache(maxsize=65536)
 def graphical_text_width(text):
-    tally = 0
-    for char in text:
-        tally += glyph_widths[char]
-    return tally
-
-def graphical_text_max_width(pins):
-    max_graphical_text_width = 0
+    try:
+        return sum(map(glyph_widths.__getitem__, text))
+    except KeyError:
+        missing_glyphs.update(char for char in text if char not in glyph_widths)
+        return sum(glyph_widths.get(char, missing_glyph_width) for char in text)
 
-    for pin in pins:
-        name = pin['Pin_name']
-        max_graphical_text_width = max(graphical_text_width(name), max_graphical_text_width)
+def pin_text_width(pin):
+    # Width of the widest of the pin name and all of its "name/function" alternate names, the alternate
+    # names are measured as name + separator + function without building the strings.
+    name_width = graphical_text_width(pin.name)
+    if not pin.functions:
+        return name_width
 
-        for func in pin['Pin_functions']:
-            name_n_func = name + "/" + func
-            max_graphical_text_width = max(graphical_text_width(name_n_func) + alt_symbol_width, max_graphical_text_width)
+    function_width = max(map(graphical_text_width, pin.functions))
+    return max(name_width, name_width + glyph_widths['/'] + function_width + alt_symbol_width)
 
-    return max_graphical_text_width
+def graphical_text_max_width(pins):
+    return max(map(pin_text_width, pins), default=0)
 
-def symbol_body_width(pins):
+def symbol_body_width(pins, text_max_width=graphical_text_max_width):
     # Get the maximum width required by the pin description text
-    max_graphical_text_width = graphical_text_max_width(pins)
+    max_graphical_text_width = text_max_width(pins)
 
     # With body width we mean including the pins ...
     pin_with_longest_text_width = max_graphical_text_width + 50 + 300
@@ -261,9 +368,7 @@ def symbol_body_width(pins):
 
 def symbol_bank_width(name, bank):
     # Make sure the bank name fits
-    max_graphical_text_width = graphical_text_max_width([{
-                             'Pin_name': name,
-                             'Pin_functions': []}])
+    max_graphical_text_width = graphical_text_width(name)
     # Get the maximum width required by the pin description text
     max_graphical_text_width = max(graphical_text_max_width(bank), max_graphical_text_width)
 
@@ -277,67 +382,103 @@ def symbol_bank_width(name, bank):
     return width
 
 
-def pin_append_combine(pin_list, new_pin):
-    # Extract the record with the same Pin number from the pin_list if available
-    pin = None
-    pin_index = 0
-    for p in pin_list:
-        if p['Pin'] == new_pin['Pin']:
-            pin = p
-            break
-        pin_index += 1
+def pin_append_combine(pin_table, new_pin, merges=None):
+    # The pin table maps the pin position to the merged pin record and the set of its functions, the set only
+    # speeds up the membership test, the order of the functions is kept by the record's function list.
+    # Every merge is added to the merges list if there is one, see merge_record.
+    # Extract the record with the same Pin number from the pin_table if available
+    entry = pin_table.get(new_pin.number)
 
-    if pin:
-        old_functions = list(pin['Pin_functions'])
+    if entry:
+        pin, known_functions = entry
+        old_function_count = len(pin.functions)
         # If the new pin's name is different than the old we add it's name to the function list
-        if pin['Pin_name'] != new_pin['Pin_name']:
-            pin['Pin_functions'].append(new_pin['Pin_name'])
+        if pin.name != new_pin.name:
+            pin.functions.append(new_pin.name)
+            known_functions.add(new_pin.name)
         # If the new pin has some additional functions we add that too to the old pins function list.
-        for function in new_pin['Pin_functions']:
-            if function not in pin['Pin_functions']:
-                pin['Pin_functions'].append(function)
+        for function in new_pin.functions:
+            if function not in known_functions:
+                pin.functions.append(function)
+                known_functions.add(function)
         # Merge pin type
-        old_t = pin['Pin_type']
-        new_t = new_pin['Pin_type']
+        old_t = pin.io_type
+        new_t = new_pin.io_type
         # If they are different then we just assume the result will be I/O (Yes I know that might be wrong but ...)
         if old_t != new_t:
-            pin["Pin_type"] = "I/O"
-        pin_list[pin_index] = pin
+            pin.io_type = "I/O"
         # Report the merging action
-        print("Merge " + "\tpin\t", pin['Pin'], \
-            "\tName:", pin['Pin_name'], \
-            "\tType:", old_t, "+", new_t, "=", pin['Pin_type'], \
-            "\tFunc:", old_functions, "+", new_pin['Pin_functions'])
-        if pin['Pin_name'] != new_pin['Pin_name']:
-            print("+", new_pin['Pin_name'])
-        print("=", pin['Pin_functions'])
+        if merges is not None or log.isEnabledFor(logging.DEBUG):
+            record = merge_record(pin, new_pin, old_t, pin.functions[old_function_count:])
+            log.debug("Merge pin %(pin)s name %(name)s + %(merged_name)s type %(types)s = %(type)s "
+                      "added functions %(added_functions)s", record)
+            if merges is not None:
+                merges.append(record)
     else:
-        pin_list.append(new_pin)
+        pin_table[new_pin.number] = (new_pin, set(new_pin.functions))
+
+
+def merge_record(pin, new_pin, old_type, added_functions):
+    # The diagnostics of one merged pin, plain json types so it can go through the symbol cache
+    return {'pin': pin.number,
+            'name': pin.name,
+            'merged_name': new_pin.name,
+            'types': [old_type, new_pin.io_type],
+            'type': pin.io_type,
+            'added_functions': list(added_functions)}
+
+
+@functools.lru_cache(maxsize=None)
+def signal_pattern(signals):
+    # One regular expression for the tuple of glob patterns
+    return re.compile("|".join(fnmatch.translate(signal) for signal in signals))
 
 
-def lib_symbol(f, source_tree, single):
+def signal_selected(signal, signals):
+    return not signals or signal_pattern(tuple(signals)).match(signal) is not None
+
+
+def source_pin(pin_data, ns="", short_pins=False, signals=None):
+    # signals are glob patterns like USART* or ADC*_IN*, only the signals matching one of them are kept
+    pin = pin_data.attrib["Position"]
+    pin_name = sys.intern(pin_data.attrib["Name"].replace(" ", ""))
+    pin_type = sys.intern(pin_data.attrib["Type"])
+    pin_functions = []
+    if not short_pins:
+        for pin_function in pin_data.iterfind(ns + "Signal"):
+            pf_name = pin_function.attrib["Name"]
+            if pf_name != None and pf_name != "GPIO" and signal_selected(pf_name, signals):
+                pin_functions.append(sys.intern(pf_name))
+    return Pin(pin, pin_name, pin_functions, pin_type)
+
+
+def merge_pins(pins, merges=None):
+    pin_table = {}
+    for pin in pins:
+        pin_append_combine(pin_table, pin, merges)
+
+    # Pins are kept in the order their position first showed up in the source file, they are final now
     data = []
+    for pin, _ in pin_table.values():
+        pin.functions = tuple(pin.functions)
+        data.append(pin)
+    return data
 
-    # Filter data for the specific footprint
-    for pin_data in source_tree.findall("Pin"):
-        pin = pin_data.attrib["Position"]
-        pin_name = pin_data.attrib["Name"].replace(" ", "")
-        pin_type = pin_data.attrib["Type"]
-        pin_functions = []
-        if not '--short-pins' in sys.argv:
-            for pin_function in pin_data.findall("Signal"):
-                pf_name = pin_function.attrib["Name"]
-                if pf_name != None and pf_name != "GPIO":
-                    pin_functions.append(pf_name)
-        pin_append_combine(data, {'Pin': pin,
-                                  'Pin_name': pin_name,
-                                  'Pin_functions': pin_functions,
-                                  'Pin_type': pin_type})
 
+def package_pad(source_attrib):
+    # The exposed pad of QFN type packages, a passive pin or a power pin if the part has a power pad. None for
+    # other packages.
+    m = re.match(".*QFPN(\d*)", source_attrib["Package"])
+    if not m:
+        return None
+    return Pin(str((int(m.group(1)) + 1)), "Pad", (), "Passive" if source_attrib["HasPowerPad"]=="false" else "Power")
+
+
+def group_banks(data, pad=None):
     # Group pins into banks
     banks = {'OTHER': [], 'VSS': [], 'VDD': []}
     for row in data:
-        pin_name = row["Pin_name"]
+        pin_name = row.name
         if re.match("VSS.?", pin_name):
             banks['VSS'].append(row)
         elif re.match("VDD.?", pin_name):
@@ -352,33 +493,71 @@ def lib_symbol(f, source_tree, single):
             else:
                 banks['OTHER'].append(row)
 
-        # Add pad pin to symbol if the package is a QFN type
-    m = re.match(".*QFPN(\d*)", source_tree.attrib["Package"])
-    if m:
-        banks['VSS'].append({'Pin': str((int(m.group(1)) + 1)),
-                             'Pin_name': "Pad",
-                             'Pin_functions': [],
-                             'Pin_type': "Passive" if source_tree.attrib["HasPowerPad"]=="false" else "Power"})
+    # Add pad pin to symbol if the package is a QFN type
+    if pad:
+        banks['VSS'].append(pad)
 
 
     # pretty_print_banks(banks)
 
+    return banks
+
+
+def mcu_model(source_attrib, source_pins):
+    return mcu_layout(source_attrib, merge_pins(source_pins))
+
+
+def mcu_layout(source_attrib, data):
+    # The banks are only grouped when they are needed, see mcu_banks, parts whose symbol layout is cached never
+    # group them
+    mcu = {'RefName': source_attrib["RefName"],
+           'Package': source_attrib["Package"],
+           'Pins': data,
+           'Pad': package_pad(source_attrib)}
+    mcu['Fingerprint'] = mcu_fingerprint(mcu)
+    return mcu
+
+
+def mcu_fingerprint(mcu):
+    # Everything the symbol geometry is drawn from, parts with the same fingerprint get identical symbols apart
+    # from their name and footprint: the merged pins and the pad of QFPN packages.
+    return hashlib.sha1(repr((mcu['Pins'], mcu['Pad'])).encode()).hexdigest()
+
+
+def mcu_banks(mcu):
+    # The pins grouped into banks, see group_banks, grouped once per part
+    if 'Banks' not in mcu:
+        mcu['Banks'] = group_banks(mcu['Pins'], mcu['Pad'])
+    return mcu['Banks']
+
+
+def symbol_layout(mcu, single, body_width=symbol_body_width, bank_width=symbol_bank_width, empty_banks=False,
+                  unit_frame_top=150):
+    # The geometry of the symbol: a list of units, each with its frame, its bank name text if any and its pins with
+    # their positions. Nothing in it depends on the part name, parts with the same fingerprint share it.
+    # body_width and bank_width measure the single symbol and the units of the multi unit symbol, empty_banks
+    # gives empty banks a unit too and unit_frame_top is the space above the first pin of a unit, see layout_styles.
+    data = mcu['Pins']
+    banks = group_banks(data, mcu['Pad'])
+    units = []
+
     #
     # Plot single symbol
     #
     if single:
-        symbol_head(f, [source_tree.attrib["RefName"]], source_tree.attrib["Package"])
-        sub_symbol_head(f, [source_tree.attrib["RefName"]])
-
         height = symbol_pin_height(banks)
         v_offset = height / 2
         v_offset -= v_offset % 100
 
-        width = symbol_body_width(data)
+        width = body_width(data)
         h_offset = width / 2
         h_offset += h_offset % 100
 
-        symbol_frame(f, -h_offset + 300, v_offset + 100, h_offset - 300, v_offset - height - 0)
+        pins = []
+        unit = {'part': 1,
+                'frame': (-h_offset + 300, v_offset + 100, h_offset - 300, v_offset - height - 0),
+                'text': None,
+                'pins': pins}
 
         # Plot all the banks except VSS and VDD
         direction = 'R'
@@ -390,11 +569,13 @@ def lib_symbol(f, source_tree, single):
                 if direction == 'R':
                     last_left_bank_height = len(banks[bank])
                     last_right_bank_height = 0
-                    symbol_bank(f, banks[bank], -h_offset, v_offset + (-100 * 17) * counter, 100, direction)
+                    pins += bank_pin_positions(banks[bank], -h_offset, v_offset + (-100 * 17) * counter, 100,
+                                               direction)
                     direction = 'L'
                 elif direction == 'L':
                     last_right_bank_height = len(banks[bank])
-                    symbol_bank(f, banks[bank], h_offset, v_offset + (-100 * 17) * counter, 100, direction)
+                    pins += bank_pin_positions(banks[bank], h_offset, v_offset + (-100 * 17) * counter, 100,
+                                               direction)
                     direction = 'R'
                     counter += 1
 
@@ -406,20 +587,17 @@ def lib_symbol(f, source_tree, single):
 
         last_bank_offset = -100 * (max(last_left_bank_height, last_right_bank_height) + 1)
 
-        symbol_bank(f, banks['VDD'], -h_offset, v_offset + (-100 * 17) * counter + last_bank_offset, 100, 'R')
-        symbol_bank(f, banks['VSS'],  h_offset, v_offset + (-100 * 17) * counter + last_bank_offset, 100, 'L')
+        pins += bank_pin_positions(banks['VDD'], -h_offset, v_offset + (-100 * 17) * counter + last_bank_offset, 100,
+                                   'R')
+        pins += bank_pin_positions(banks['VSS'],  h_offset, v_offset + (-100 * 17) * counter + last_bank_offset, 100,
+                                   'L')
 
-        sub_symbol_foot(f)
-        symbol_foot(f)
+        units.append(unit)
 
     #
     # Plot symbol with parts
     #
     else:
-        sym_names = [source_tree.attrib["RefName"]]
-
-        symbol_head(f, sym_names, source_tree.attrib["Package"])
-
         sorted_banks = []
         sorted_keys = []
 
@@ -435,118 +613,1135 @@ def lib_symbol(f, source_tree, single):
 
         part = 1
         for bank_name, bank in zip(sorted_keys, sorted_banks):
-            if not len(bank):
+            if not len(bank) and not empty_banks:
                 continue
             height = len(bank) * 100
             v_offset = height / 2
             v_offset -= v_offset % 100
 
-            width = symbol_bank_width(bank_name, bank) + 200
+            width = bank_width(bank_name, bank) + 200
             h_offset = width / 2
             h_offset += h_offset % 100
 
-            sub_symbol_head(f, sym_names, part)
+            units.append({'part': part,
+                          'frame': (-h_offset + 300, v_offset + unit_frame_top, h_offset - 300,
+                                    v_offset - height - 0),
+                          'text': (0, v_offset + 100, bank_name),
+                          'pins': bank_pin_positions(bank, h_offset, v_offset, 100, 'L')})
 
-            symbol_frame(f, -h_offset + 300, v_offset + 150, h_offset - 300, v_offset - height - 0, part)
+            part += 1
 
-            symbol_bank_text(f, 0, v_offset + 100, bank_name)
+    return units
 
-            symbol_bank(f, bank, h_offset, v_offset, 100, 'L', part)
 
-            sub_symbol_foot(f)
+def cached_symbol_layout(mcu, single, style='kicad_sym'):
+    # Reuse the layout of an earlier part with the same fingerprint, the least recently used layouts are dropped
+    # once there are more than layout_cache_size of them
+    key = (mcu['Fingerprint'], single, style)
+    layout = layout_cache.get(key)
+    if layout is not None:
+        layout_cache.move_to_end(key)
+        layout_cache_stats['hits'] += 1
+        return layout
 
-            part += 1
+    layout_cache_stats['misses'] += 1
+    layout = symbol_layout(mcu, single, **layout_styles[style])
+    if layout_cache_size:
+        layout_cache[key] = layout
+        if len(layout_cache) > layout_cache_size:
+            layout_cache.popitem(last=False)
+    return layout
+
+
+def lib_symbol(f, mcu, single):
+    sym_names = [mcu['RefName']]
+
+    symbol_head(f, sym_names, mcu['Package'])
+
+    for unit in cached_symbol_layout(mcu, single):
+        part = unit['part']
+        sub_symbol_head(f, sym_names, part)
+
+        symbol_frame(f, *unit['frame'], part)
+
+        if unit['text']:
+            symbol_bank_text(f, *unit['text'])
+
+        for pin, x, y, direction in unit['pins']:
+            symbol_pin(f, pin.name, pin.functions, pin.number, x, y, direction, pin.io_type, part)
+
+        sub_symbol_foot(f)
+
+    symbol_foot(f)
+
+
+def legacy_lib_head(f):
+    f.write('EESchema-Library Version 2.3\n\n')
+    f.write('#encoding utf-8\n')
+
+
+def legacy_lib_foot(f):
+    f.write('#\n')
+    f.write('#End Library\n')
 
-        symbol_foot(f)
 
+def legacy_symbol_head(f, names, footprint, parts=1):
+    f.write("#\n")
+    f.write("# " + names[0] + "\n")
+    f.write("#\n")
+    f.write("DEF " + names[0] + " U 0 50 Y Y " + str(parts) + " F N\n")
+    f.write("F0 \"U\" 0 100 50 H V C CNN\n")
+    f.write("F1 \"" + names[0] + "\" 0 -100 50 H V C CNN\n")
+    f.write("F2 \"" + footprint + "\" 0 -200 50 H V C CIN\n")
+    f.write("F3 \"\" 0 0 50 H V C CNN\n")
+    f.write("DRAW\n")
 
-def symbols_from_file(source_filename, target_file, single):
+
+def legacy_symbol_foot(f):
+    f.write("ENDDRAW\n")
+    f.write("ENDDEF\n")
+
+
+def legacy_symbol_frame(f, startx, starty, endx, endy, part=1):
+    f.write("S {:g} {:g} {:g} {:g} {:g} 1 10 N\n".format(startx, starty, endx, endy, part))
+
+
+def legacy_symbol_pin(f, pin, x, y, direction, part=1):
+    # The legacy format has no alternate pin functions, they are part of the pin name
+    name = "/".join((pin.name,) + tuple(pin.functions))
+    pin_type = legacy_pin_types.get(pin.io_type, 'B')
+    f.write("X {} {} {:g} {:g} 300 {} 50 50 {:g} 1 {}\n".format(name, pin.number, x, y, direction, part, pin_type))
+
+
+def legacy_text_max_width(pins):
+    # Width of the longest "name/function/function..." pin name
+    slash_width = glyph_widths['/']
+    return max((graphical_text_width(pin.name) + sum(slash_width + graphical_text_width(function)
+                                                     for function in pin.functions)
+                for pin in pins), default=0)
+
+
+def legacy_bank_width(name, bank):
+    # The legacy units have no bank name text
+    real_width = legacy_text_max_width(bank) + 50 + 300 + graphical_text_width("  ")
+    return real_width + (100 - (real_width % 100))
+
+
+# The layout parameters of the library formats, see symbol_layout. The legacy pin names carry the alternate
+# functions, so they are measured with them.
+layout_styles = {
+    'kicad_sym': {},
+    'legacy': {'body_width': functools.partial(symbol_body_width, text_max_width=legacy_text_max_width),
+               'bank_width': legacy_bank_width, 'empty_banks': True, 'unit_frame_top': 100},
+}
+
+
+def legacy_symbol(f, mcu):
+    # The legacy library has the single symbol and the multi unit symbol of a part next to each other, the multi
+    # unit symbol has a _u suffix and a unit for every bank, including empty ones
+    for suffix, single in (("", True), ("_u", False)):
+        units = cached_symbol_layout(mcu, single, 'legacy')
+        legacy_symbol_head(f, [mcu['RefName'] + suffix], mcu['Package'], len(units))
+
+        for unit in units:
+            part = unit['part']
+            legacy_symbol_frame(f, *unit['frame'], part)
+            for pin, x, y, direction in unit['pins']:
+                legacy_symbol_pin(f, pin, x, y, direction, part)
+
+        legacy_symbol_foot(f)
+
+
+def pin_table_symbol(f, mcu):
+    # One json line per part with all of its pins, the pins of a bank are in symbol order
+    banks = mcu_banks(mcu)
+    pins = [{'number': pin.number,
+             'name': pin.name,
+             'type': pin.io_type,
+             'bank': bank,
+             'functions': list(pin.functions)}
+            for bank in sorted(banks) for pin, _, _, _ in bank_pin_positions(banks[bank], 0, 0, 0, 'L')]
+    f.write(json.dumps({'name': mcu['RefName'], 'package': mcu['Package'], 'pins': pins}) + "\n")
+
+
+def no_lib_head(f):
+    pass
+
+
+# A quoted string, the whitespace after an opening or before a closing parenthesis, the whitespace before a unit or
+# a pin, or any other whitespace
+compact_re = re.compile(r'("(?:[^"\\]|\\.)*")|((?<=\()\s+|\s+(?=\)))|(\s+(?=\((?:symbol|pin)\s))|\s+')
+
+
+def compact_sexpr(text):
+    # The S-expression text with a single space between expressions, quoted strings are kept as they are. Every unit
+    # and every pin starts a new line indented by one space, so changing a pin only changes its own line in a diff
+    # and only the top level symbols start at the beginning of a line, see read_library_symbols. KiCad reads any
+    # whitespace between the tokens.
+    return compact_re.sub(lambda m: m.group(1) or ("" if m.group(2) else "\n " if m.group(3) else " "),
+                          text).strip() + "\n"
+
+
+# The kinds of library files the generator can write, every source file is parsed once for all of them. A kind has
+# the suffix added to the library name, the file extension, the library head and foot writers, the symbol writer,
+# whether parts with the same pinout can be derived symbols, whether the library can be updated in place, whether
+# it is an S-expression library that can be written compact, see compact_sexpr, the symbol layouts the symbol writer
+# uses, see cached_symbol_layout, and whether it uses the banks of the part, see mcu_banks.
+library_kinds = {
+    'single': {'suffix': "", 'extension': ".kicad_sym", 'head': lib_head, 'foot': lib_foot,
+               'symbol': functools.partial(lib_symbol, single=True), 'derived': True, 'update': True,
+               'compact': True, 'layouts': ((True, 'kicad_sym'),), 'banks': False},
+    'multi': {'suffix': "_u", 'extension': ".kicad_sym", 'head': lib_head, 'foot': lib_foot,
+              'symbol': functools.partial(lib_symbol, single=False), 'derived': True, 'update': True,
+              'compact': True, 'layouts': ((False, 'kicad_sym'),), 'banks': False},
+    'legacy': {'suffix': "", 'extension': ".lib", 'head': legacy_lib_head, 'foot': legacy_lib_foot,
+               'symbol': legacy_symbol, 'derived': False, 'update': False, 'compact': False,
+               'layouts': ((True, 'legacy'), (False, 'legacy')), 'banks': False},
+    'pin_table': {'suffix': "", 'extension': ".jsonl", 'head': no_lib_head, 'foot': no_lib_head,
+                  'symbol': pin_table_symbol, 'derived': False, 'update': False, 'compact': False,
+                  'layouts': (), 'banks': True},
+}
+
+
+def package_selected(package, packages):
+    return not packages or package.startswith(tuple(packages))
+
+
+def read_source_file(source_filename):
+    # Read the whole source file into memory, so reading it can be timed apart from parsing it
+    try:
+        with open(source_filename, 'rb') as f:
+            return io.BytesIO(f.read())
+    except OSError as e:
+        raise GeneratorError(f"failed to open source file '{source_filename}': {e}")
+
+
+def source_from_file(source_filename, short_pins=False, packages=None, source=None, signals=None):
     # Open pin definition file
     # print("Loading source file: " + source_filename)
 
-    source_data = None
-    # Try to load the source file
+    # source is the content of the file if it was already read, see read_source_file
+    # Only the attributes of the root element and its Pin elements are used, so the file is streamed and every
+    # top level element is dropped as soon as it is read instead of building the whole tree.
+    # If the package is not one of the selected packages None is returned for the pins and the rest of the file
+    # is not read. signals selects the alternate functions that are kept, see source_pin.
+    source_attrib = None
+    source_pins = []
     try:
-        with open(source_filename) as f:
-            source_data = f.read()
-            f.close()
-    except:
-        print("failed to open source file")
-        print("Exitinig!")
-        exit(1)
-
-    # Remove xmlns (xml namespace)
-    source_data = re.sub(' xmlns="[^"]+"', '', source_data, count=1)
-
-    source_tree = None
-    # Read and parse the data file
+        root = None
+        ns = ""
+        depth = 0
+        for event, elem in xml.etree.ElementTree.iterparse(source or source_filename, events=('start', 'end')):
+            if event == 'start':
+                if root is None:
+                    root = elem
+                    source_attrib = dict(root.attrib)
+                    # The database files use a default namespace, all tags carry it
+                    if root.tag.startswith('{'):
+                        ns = root.tag[:root.tag.index('}') + 1]
+                    if not package_selected(source_attrib["Package"], packages):
+                        return source_attrib, None
+                depth += 1
+            else:
+                depth -= 1
+                if depth == 1:
+                    if elem.tag == ns + "Pin":
+                        source_pins.append(source_pin(elem, ns, short_pins, signals))
+                    root.clear()
+    except OSError as e:
+        raise GeneratorError(f"failed to open source file '{source_filename}': {e}")
+    except xml.etree.ElementTree.ParseError as e:
+        raise GeneratorError(f"source file '{source_filename}' parsing failed: {e}")
+
+    return source_attrib, source_pins
+
+
+def symbols_from_file(source_filename, short_pins=False, packages=None, signals=None):
+    source_attrib, source_pins = source_from_file(source_filename, short_pins, packages, signals=signals)
+    if source_pins is None:
+        return None
+
+    # print("Generating symbols for: " + source_attrib["RefName"])
+
+    return mcu_model(source_attrib, source_pins)
+
+
+def library_filename(output_dir, library_name, kind='single'):
+    return os.path.join(output_dir, f"{library_name.lower()}{library_kinds[kind]['extension']}")
+
+
+def open_library(output_dir, library_name, kind='single', compact=False):
+    lib_filename = library_filename(output_dir, library_name, kind)
+
+    log.info("Opening '%s' as our target library file", lib_filename)
+
+    # The library is written to a temporary file that only replaces the target once it is complete, so a
+    # crashed run never leaves a truncated library behind that KiCad fails to load.
     try:
-        source_tree = xml.etree.ElementTree.fromstring(source_data)
-    except:
-        print("source file parsing failed")
-        print("Exiting!")
-        exit(1)
+        libf = open(lib_filename + ".tmp", 'w')
+    except OSError as e:
+        raise GeneratorError(f"could not open target library file '{lib_filename}': {e}")
+
+    head = io.StringIO()
+    library_kinds[kind]['head'](head)
+    libf.write(compact_sexpr(head.getvalue()) if compact and library_kinds[kind]['compact'] else head.getvalue())
+
+    return libf
+
+
+def close_library(libf, complete=True, kind='single'):
+    if complete:
+        library_kinds[kind]['foot'](libf)
+    libf.close()
+
+    if complete:
+        # Strip the .tmp suffix
+        os.replace(libf.name, os.path.splitext(libf.name)[0])
+    else:
+        os.remove(libf.name)
+
+
+@functools.lru_cache(maxsize=None)
+def generator_digest():
+    # Any change to the generator code can change the output, so the code itself is part of the cache key
+    with open(__file__, 'rb') as f:
+        return hashlib.sha256(f.read()).hexdigest()
+
+
+@functools.lru_cache(maxsize=None)
+def merge_model_digest():
+    # The pin database holds the merged pins, only the code that parses and merges them is part of its version, see
+    # compile_pin_db
+    h = hashlib.sha256()
+    for code in (Pin, source_pin, pin_append_combine, merge_record, merge_pins, compile_part):
+        h.update(inspect.getsource(code).encode())
+    return h.hexdigest()
 
-    # print("Generating symbols for: " + source_tree.attrib["RefName"])
 
-    lib_symbol(target_file, source_tree, single)
+def source_digest(source_filename):
+    with open(source_filename, 'rb') as f:
+        return hashlib.sha256(f.read()).hexdigest()
 
 
-def generate_library(library_name, source_filenames, single):
-    # Open single symbol library file
-    lib_filename = f"../{library_name.lower()}.kicad_sym"
+def symbol_cache_key(digest, kinds, short_pins, compact=False, signals=None):
+    # digest is the source_digest of the source file, the pin database keeps it for every part
+    h = hashlib.sha256()
+    h.update(generator_version.encode())
+    h.update(generator_digest().encode())
+    h.update(json.dumps([list(kinds), short_pins, compact, list(signals or ())]).encode())
+    h.update(digest.encode())
+    return h.hexdigest()
 
-    print("Opening '" + lib_filename + "' as our target library file")
 
+def symbol_cache_load(cache_dir, key):
     try:
-        libf = open(lib_filename, 'w')
-    except:
-        print("could not open target library file")
-        print("Exiting!")
-        exit(1)
+        with open(os.path.join(cache_dir, key + ".json")) as f:
+            entry = json.load(f)
+    except (OSError, ValueError):
+        return None
 
-    lib_head(libf)
+    return entry['texts'], entry['stats']
+
+
+def symbol_cache_store(cache_dir, key, texts, stats):
+    cache_filename = os.path.join(cache_dir, key + ".json")
+    # Write to a private file first and move it in place, concurrent workers and crashed runs never leave
+    # a partial entry behind
+    tmp_filename = f"{cache_filename}.{os.getpid()}.tmp"
+    try:
+        with open(tmp_filename, 'w') as f:
+            json.dump({'texts': texts, 'stats': stats}, f)
+        os.replace(tmp_filename, cache_filename)
+    except OSError:
+        log.warning("could not write symbol cache entry '%s'", cache_filename)
+
+
+def render_symbol(mcu, single):
+    symbol = io.StringIO()
+    lib_symbol(symbol, mcu, single)
+    return symbol.getvalue()
+
+
+def phase_time(times, phase, start):
+    # Record the time since start as the time of phase, returns the start of the next phase
+    now = time.perf_counter()
+    times[phase] = now - start
+    return now
+
+
+def mcu_unknown_pin_types(mcu):
+    # The source pin types of the part that have no KiCad pin type, they get default_pin_type
+    # The pad has a known type, only the pins need to be checked
+    return dict(collections.Counter(pin.io_type for pin in mcu['Pins']
+                                    if pin.io_type not in pin_types))
+
+
+def render_symbols(source_filename, kinds=('single', 'multi'), short_pins=False, packages=None, cache_dir=None,
+                   profile=False, pin_db=None, compact=False, signals=None):
+    # Parse one source file and render its symbols, this is the unit of work handed to the worker pool.
+    # Returns the symbol text of every library kind in kinds, see library_kinds, and the statistics of the source
+    # file. The texts are None if the package of the source file is not one of the selected packages.
+    # With profile the statistics also get the time spent in every phase, the source file is then read into
+    # memory before it is parsed so reading and parsing are timed separately.
+    # With pin_db the part named like the source file is loaded from the compiled pin database instead, the source
+    # file itself is not needed. With compact the S-expression symbols are written without indentation, see
+    # compact_sexpr. signals selects the alternate functions of the pins, see source_pin.
+    times = {}
+    mark = time.perf_counter()
+    part = None
+    if pin_db:
+        part = pin_db_part(pin_db, os.path.splitext(os.path.basename(source_filename))[0])
+        mark = phase_time(times, 'read', mark)
+    key = None
+    if cache_dir:
+        try:
+            key = symbol_cache_key(part['source_digest'] if part else source_digest(source_filename), kinds,
+                                   short_pins, compact, signals)
+        except OSError:
+            # symbols_from_file reports the unreadable file below
+            pass
+        cached = symbol_cache_load(cache_dir, key) if key else None
+        if cached:
+            texts, stats = cached
+            if not package_selected(stats['package'], packages):
+                return None, {'filtered': True}
+            stats['cached'] = True
+            stats['filtered'] = False
+            if profile:
+                phase_time(times, 'cache', mark)
+                stats['profile'] = times
+                stats['source'] = source_filename
+            return texts, stats
+        mark = phase_time(times, 'cache', mark)
+
+    if part:
+        source_attrib, data, source_count, merges = pin_db_source(part, short_pins, packages, signals)
+        mark = phase_time(times, 'parse', mark)
+        if data is None:
+            return None, {'filtered': True}
+    else:
+        source = read_source_file(source_filename) if profile else None
+        mark = phase_time(times, 'read', mark)
+        source_attrib, source_pins = source_from_file(source_filename, short_pins, packages, source, signals)
+        mark = phase_time(times, 'parse', mark)
+        if source_pins is None:
+            return None, {'filtered': True}
+        source_count = len(source_pins)
+        merges = []
+        data = merge_pins(source_pins, merges)
+        mark = phase_time(times, 'merge', mark)
+    missing_glyphs.clear()
+    layout_cache_start = layout_cache_stats.copy()
+    # The layouts are computed, or taken from the layout cache, up front so the render phase is only the writing
+    mcu = mcu_layout(source_attrib, data)
+    for kind in kinds:
+        for single, style in library_kinds[kind]['layouts']:
+            cached_symbol_layout(mcu, single, style)
+        if library_kinds[kind]['banks']:
+            mcu_banks(mcu)
+    mark = phase_time(times, 'layout', mark)
+
+    # All library kinds are rendered from the same model
+    texts = {}
+    for kind in kinds:
+        symbol = io.StringIO()
+        library_kinds[kind]['symbol'](symbol, mcu)
+        texts[kind] = symbol.getvalue()
+        if compact and library_kinds[kind]['compact']:
+            texts[kind] = compact_sexpr(texts[kind])
+    stats = {'name': mcu['RefName'],
+             'package': mcu['Package'],
+             'fingerprint': mcu['Fingerprint'],
+             'unknown_pin_types': mcu_unknown_pin_types(mcu),
+             'missing_glyphs': sorted(missing_glyphs),
+             'pins': source_count,
+             'merged_pins': source_count - len(data),
+             'alternates': sum(len(pin.functions) for pin in data),
+             'merges': merges}
+    phase_time(times, 'render', mark)
+
+    if key:
+        symbol_cache_store(cache_dir, key, texts, stats)
+
+    stats['cached'] = False
+    stats['filtered'] = False
+    stats['layout_cache'] = dict(layout_cache_stats - layout_cache_start)
+    if profile:
+        stats['profile'] = times
+        stats['source'] = source_filename
+    return texts, stats
+
+
+def compile_part(source_filename):
+    # Parse and merge a source file into the part record of the pin database, see stm32pindb.store_part
+    source_attrib, source_pins = source_from_file(source_filename)
+    merges = []
+    data = merge_pins(source_pins, merges)
+
+    # The functions merge_pins added for a merged pin are the merged pin's name, if it differs, and its functions.
+    # Only the names are kept when the database is read with short pins.
+    added = collections.defaultdict(list)
+    for record in merges:
+        added[record['pin']].append(record)
+    pins = []
+    for pin in data:
+        merged_pin_flags = []
+        for record in added[pin.number]:
+            merged_pin_flags += [i == 0 and record['merged_name'] != record['name']
+                                 for i in range(len(record['added_functions']))]
+        flags = [False] * (len(pin.functions) - len(merged_pin_flags)) + merged_pin_flags
+        pins.append((pin.number, pin.name, list(zip(pin.functions, flags)), pin.io_type))
+
+    stat = os.stat(source_filename)
+    return {'name': source_attrib["RefName"],
+            'package': source_attrib["Package"],
+            'has_power_pad': source_attrib.get("HasPowerPad", "false"),
+            'source': source_filename,
+            'source_digest': source_digest(source_filename),
+            'source_size': stat.st_size,
+            'source_mtime': stat.st_mtime_ns,
+            'source_pins': len(source_pins),
+            'merges': merges,
+            'pins': pins}
+
+
+def compile_pin_db(source_dir, db_filename, jobs=1):
+    """Bring the pin database db_filename up to date with the source files in source_dir.
+
+    Only the source files whose size or modification time changed since they were compiled are parsed, the parts
+    of deleted source files are removed. A database compiled by another version of the merge code, see
+    merge_model_digest, is compiled from scratch.
+    """
+    try:
+        conn = stm32pindb.connect(db_filename, create=True)
+    except (OSError, ValueError, sqlite3.Error) as e:
+        raise GeneratorError(f"could not open pin database '{db_filename}': {e}")
+
+    source_filenames = sorted(os.path.abspath(f) for f in glob.glob(os.path.join(source_dir, "STM32*.xml")))
+    pool = None
+    try:
+        with conn:
+            if stm32pindb.get_meta(conn, 'merge_model') != merge_model_digest():
+                conn.execute("DELETE FROM parts")
+                stm32pindb.set_meta(conn, 'merge_model', merge_model_digest())
+            states = stm32pindb.source_states(conn)
+            changed = []
+            for source_filename in source_filenames:
+                stat = os.stat(source_filename)
+                if states.get(source_filename) != (stat.st_size, stat.st_mtime_ns):
+                    changed.append(source_filename)
+            removed = states.keys() - set(source_filenames)
+
+            pool = multiprocessing.Pool(jobs) if jobs > 1 and len(changed) > 1 else None
+            parts = pool.imap(compile_part, changed, chunksize=max(1, len(changed) // (jobs * 4))) if pool \
+                else map(compile_part, changed)
+            name_ids = {}
+            for part in parts:
+                stm32pindb.store_part(conn, part, name_ids)
+            stm32pindb.remove_sources(conn, removed)
+    except sqlite3.Error as e:
+        raise GeneratorError(f"could not write pin database '{db_filename}': {e}")
+    finally:
+        if pool:
+            pool.terminate()
+            pool.join()
+        conn.close()
+
+    log.info(f"Compiled {len(changed)} changed source files into '{db_filename}', removed {len(removed)} parts, "
+             f"{len(source_filenames) - len(changed)} parts were up to date.")
+
+
+# Open pin database connections by filename and process, workers must not share the connection of their parent
+pin_db_connections = {}
+
+
+def pin_db_connection(db_filename):
+    key = (db_filename, os.getpid())
+    if key not in pin_db_connections:
+        try:
+            conn = stm32pindb.connect(db_filename)
+        except (OSError, ValueError) as e:
+            raise GeneratorError(f"{e}, compile it with --compile-db")
+        except sqlite3.Error as e:
+            raise GeneratorError(f"could not open pin database '{db_filename}': {e}")
+        if stm32pindb.get_meta(conn, 'merge_model') != merge_model_digest():
+            conn.close()
+            raise GeneratorError(f"pin database '{db_filename}' has another version of the merged pin model, compile "
+                                 "it again with --compile-db")
+        pin_db_connections[key] = conn
+    return pin_db_connections[key]
+
+
+def pin_db_part(db_filename, name):
+    part = stm32pindb.load_part(pin_db_connection(db_filename), name)
+    if part is None:
+        raise GeneratorError(f"no part '{name}' in pin database '{db_filename}'")
+    return part
+
+
+def pin_db_source(part, short_pins=False, packages=None, signals=None):
+    # The source attributes, the merged pins, the number of source pins and the merge records of a part of the pin
+    # database, the pins are None if the package is not one of the selected packages. The names of merged pins are
+    # kept, like they are when signals are dropped while parsing the source file.
+    source_attrib = {'RefName': part['name'], 'Package': part['package'], 'HasPowerPad': part['has_power_pad']}
+    if not package_selected(part['package'], packages):
+        return source_attrib, None, 0, []
+
+    data = []
+    for number, pin_name, functions, io_type in part['pins']:
+        functions = tuple(sys.intern(function) for function, merged_pin in functions
+                          if merged_pin or not short_pins and signal_selected(function, signals))
+        data.append(Pin(number, sys.intern(pin_name), functions, sys.intern(io_type)))
+    return source_attrib, data, part['source_pins'], part['merges']
+
+
+def render_library_symbols(source_filenames, pool=None, jobs=1, **options):
+    # The options are passed on to render_symbols
+    render = functools.partial(render_symbols, **options)
+
+    if pool is None:
+        return map(render, source_filenames)
+
+    # imap hands back the results in the order of the filenames, no matter which worker finishes first
+    return pool.imap(render, source_filenames, chunksize=max(1, len(source_filenames) // (jobs * 4)))
+
+
+def new_run_stats():
+    # files has a profile record per source file when profiling, libraries the size of every written library and
+    # diagnostics the merged pins and unknown pin types of every part that has any
+    return {'unknown_pin_types': collections.Counter(), 'missing_glyphs': set(), 'files': [], 'libraries': {},
+            'diagnostics': {}, 'layout_cache': collections.Counter()}
+
+
+def update_run_stats(run_stats, stats):
+    run_stats['unknown_pin_types'].update(stats['unknown_pin_types'])
+    run_stats['missing_glyphs'].update(stats['missing_glyphs'])
+    run_stats['files'].extend(stats.get('files', ()))
+    run_stats['libraries'].update(stats.get('libraries', {}))
+    run_stats['diagnostics'].update(stats.get('diagnostics', {}))
+    run_stats['layout_cache'].update(stats.get('layout_cache', {}))
+
+
+def profile_record(library_name, stats):
+    # One row of the profile report
+    record = {'library': library_name.lower(),
+              'name': stats['name'],
+              'source': stats['source'],
+              'cached': stats['cached']}
+    for phase in profile_phases:
+        record[phase] = stats['profile'].get(phase, 0.0)
+    record['total'] = sum(record[phase] for phase in profile_phases)
+    for counter in profile_counters:
+        record[counter] = stats[counter]
+    return record
+
+
+def read_library_symbols(lib_filename):
+    # Split a library written by this generator into its top level symbols, returns the symbol text by name in
+    # library order, or an empty dict if there is no library yet.
+    try:
+        with open(lib_filename) as f:
+            content = f.read()
+    except FileNotFoundError:
+        return {}
+    except OSError as e:
+        raise GeneratorError(f"could not read library file '{lib_filename}': {e}")
+
+    if not content.startswith("(kicad_symbol_lib") or not content.endswith(")"):
+        raise GeneratorError(f"'{lib_filename}' is not a complete symbol library")
+
+    symbols = {}
+    # The body is everything between the library head and the closing parenthesis written by lib_foot, the
+    # symbols start on their own line, indented in pretty and not indented in compact libraries
+    blocks = re.split(r'(?m)^(?=(?:    )?\(symbol ")', content[:-1])
+    for block in blocks[1:]:
+        symbols[re.match(r'\s*\(symbol "([^"]*)"', block).group(1)] = block
+
+    return symbols
+
+
+def derived_symbol_parent(symbol_text):
+    m = re.match(r'\s*\(symbol "[^"]*"\s*\(extends "([^"]*)"\)', symbol_text)
+    return m.group(1) if m else None
+
+
+def generate_library(output_dir, library_name, symbols, kinds=('single', 'multi'), update=False, suffix="",
+                     derived=True, compact=False):
+    # Open a library file of every kind in kinds, see library_kinds, every source file is parsed only once and
+    # the resulting symbols are written to all of them.
+    # With derived, parts with the same pinout as an earlier part of the library are written as derived symbols
+    # that extend the earlier one.
+    # With update the symbols replace the symbols of the same name in the existing libraries, symbols that are
+    # new to a library are added at its end. Updated symbols are always written in full, derived symbols in the
+    # existing library could otherwise end up extending a parent with a different pinout.
+    # With compact the heads and derived symbols of the S-expression libraries are compact like the rendered
+    # symbols, see render_symbols.
+    lib_names = {kind: library_name + library_kinds[kind]['suffix'] + suffix for kind in kinds}
+
+    existing = {}
+    if update:
+        for kind, lib_name in lib_names.items():
+            if not library_kinds[kind]['update']:
+                raise GeneratorError(f"{kind} libraries can not be updated, regenerate them instead")
+            existing[kind] = read_library_symbols(library_filename(output_dir, lib_name, kind))
+    libs = {}
+    try:
+        for kind, lib_name in lib_names.items():
+            libs[kind] = open_library(output_dir, lib_name, kind, compact)
+    except GeneratorError:
+        for kind, lib in libs.items():
+            close_library(lib, False, kind)
+        raise
 
     sources_count = 0
-    if True:
-        for source_filename in source_filenames:
-            symbols_from_file(source_filename, libf, single)
+    cached_count = 0
+    filtered_count = 0
+    added_count = 0
+    derived_count = 0
+    # First part of every pinout fingerprint, the parent of all later parts with the same pinout
+    parents = {}
+    updated_names = set()
+    library_stats = new_run_stats()
+    complete = False
+    try:
+        # Every symbol is rendered into its own buffer and goes out with a single write
+        for texts, stats in symbols:
+            if stats['filtered']:
+                filtered_count += 1
+                continue
+            write_start = time.perf_counter()
+            parent = None
+            if derived and not update and any(library_kinds[kind]['derived'] for kind in kinds):
+                parent = parents.setdefault(stats['fingerprint'], stats['name'])
+                if parent == stats['name']:
+                    parent = None
+                else:
+                    derived_text = io.StringIO()
+                    derived_symbol(derived_text, stats['name'], parent, stats['package'])
+                    derived_count += 1
+            for kind, text in texts.items():
+                if parent and library_kinds[kind]['derived']:
+                    text = derived_text.getvalue()
+                    if compact and library_kinds[kind]['compact']:
+                        text = compact_sexpr(text)
+                if update:
+                    added_count += stats['name'] not in existing[kind]
+                    existing[kind][stats['name']] = text
+                else:
+                    libs[kind].write(text)
+            if 'profile' in stats:
+                stats['profile']['write'] = time.perf_counter() - write_start
+                library_stats['files'].append(profile_record(library_name, stats))
+            if stats['merges'] or stats['unknown_pin_types']:
+                library_stats['diagnostics'][stats['name']] = {'merged_pins': stats['merges'],
+                                                               'unknown_pin_types': stats['unknown_pin_types']}
+            updated_names.add(stats['name'])
             sources_count += 1
+            cached_count += stats['cached']
+            update_run_stats(library_stats, stats)
+        if update:
+            for kind, lib in libs.items():
+                stale = [name for name, text in existing[kind].items()
+                         if name not in updated_names and derived_symbol_parent(text) in updated_names]
+                if stale:
+                    raise GeneratorError(f"the symbols {stale} in {lib_names[kind].lower()} extend updated symbols, "
+                                         "select them too or regenerate the whole library")
+                lib.write("".join(existing[kind].values()))
+        complete = True
+    finally:
+        for kind, lib in libs.items():
+            close_library(lib, complete, kind)
+
+    for kind, lib_name in lib_names.items():
+        lib_filename = library_filename(output_dir, lib_name, kind)
+        library_stats['libraries'][os.path.basename(lib_filename)] = {
+            'shard': library_name,
+            'kind': kind,
+            'symbols': len(existing[kind]) if update else sources_count,
+            'bytes': os.path.getsize(lib_filename)}
+
+    for kind, lib_name in lib_names.items():
+        lib_filename = os.path.basename(library_filename(output_dir, lib_name, kind))
+        if update:
+            log.info(f"Updated {sources_count} symbols in {lib_filename}.")
+        else:
+            log.info(f"Generated {sources_count} symbols in {lib_filename}.")
+    if added_count:
+        log.info(f"{added_count} of the updated symbols are new and were added at the end of the library.")
+    if derived_count:
+        log.info(f"{derived_count} of them share the pinout of an earlier part and extend its symbol.")
+    if cached_count:
+        log.info(f"Reused {cached_count} of them from the symbol cache.")
+    if filtered_count:
+        log.info(f"Skipped {filtered_count} source files with other packages.")
+
+    return library_stats
+
+
+def report_run_stats(run_stats):
+    for io_type, count in sorted(run_stats['unknown_pin_types'].items()):
+        if io_type:
+            log.warning(f"{count} pins have the unknown type '{io_type}', they default to {default_pin_type}.")
+        else:
+            log.warning(f"{count} pins have an empty io type, they default to {default_pin_type}.")
+    if run_stats['diagnostics']:
+        merge_count = sum(len(part['merged_pins']) for part in run_stats['diagnostics'].values())
+        log.info(f"Merged {merge_count} pins that share their position with another pin.")
+    layouts = run_stats['layout_cache']
+    if layouts['hits']:
+        log.info(f"Reused {layouts['hits']} of {layouts['hits'] + layouts['misses']} symbol layouts of parts with "
+                 "the same pinout.")
+    if run_stats['missing_glyphs']:
+        log.warning(f"No glyph widths for the characters {sorted(run_stats['missing_glyphs'])}, "
+                    f"they are measured {missing_glyph_width} wide.")
+
+
+def source_filename_selected(source_filename, mcu_pattern=None, packages=None):
+    # Decide on the filename alone, so the source files of other parts are never opened
+    part_name = os.path.splitext(os.path.basename(source_filename))[0]
+    if mcu_pattern and not re.search(mcu_pattern, part_name):
+        return False
+    if packages:
+        m = re.search(r"([A-Z])x[A-Z]*$", part_name)
+        if m and m.group(1) in package_code_letters:
+            return any(package_selected(package, packages) for package in package_code_letters[m.group(1)])
+    return True
+
+
+def source_filename_groups(source_dir, families=None, mcu_pattern=None, packages=None, shard='family',
+                           shard_size=None, pin_db=None):
+    # Group the source files into shards, one library is generated per group. A shard is named after the start of
+    # the part names it contains: STM32F for the family, STM32F4 for the sub family and STM32F405 for the series
+    # line. Groups of more than shard_size parts are split into numbered shards of at most shard_size parts.
+    # The parts of a pin database stand in for the source files of the same name
+    if pin_db:
+        source_filenames = sorted(name + ".xml" for name in stm32pindb.part_names(pin_db_connection(pin_db)))
     else:
-        p = re.compile(".*STM32L4P5C.*E.*U.*")
-        filenames = [ f for f in source_filenames if p.match(f) ]
-        print(f"matched list {library_name} {filenames}")
-        for filename in filenames:
-            symbols_from_file(filename, libf, single)
-        sources_count += 1
+        source_filenames = sorted(glob.glob(os.path.join(source_dir, "STM32*.xml")))
+
+    groups = {}
+    for file in source_filenames:
+        part_name = os.path.basename(file)
+        # print("part {} {}".format(part_name, part_name[5]))
+        if families and part_name[5].upper() not in families:
+            continue
+        if not source_filename_selected(file, mcu_pattern, packages):
+            continue
+        group = part_name[:shard_name_lengths[shard]].upper()
+        if group not in groups.keys():
+            groups[group] = [file]
+        else:
+            groups[group].append(file)
 
-    lib_foot(libf)
+    if shard_size:
+        shards = {}
+        for group, files in groups.items():
+            if len(files) <= shard_size:
+                shards[group] = files
+                continue
+            for i in range(0, len(files), shard_size):
+                shards[f"{group}_{i // shard_size + 1}"] = files[i:i + shard_size]
+        groups = shards
 
-    libf.close()
+    # print("groups {}".format(groups))
 
-    print(f"Generated {sources_count} symbols in {library_name.lower()}.")
+    return groups
 
-# width = graphical_text_width("PA7/ADC_IN7/12S1_SD/SPI1_MOSI/TIM14_CH1/TIM17_CH1/TIM1_CH1N/TIM3_CH2")
-# print "Test Text Width: " + str(width) + " double: " + str(width * 2) + "\n"
 
-source_dir = "../stm32cube/db/mcu"
-source_filenames = sorted(glob.glob(source_dir + "/STM32*.xml"))
+def generate_libraries(source_dir, output_dir, families=None, kinds=('single', 'multi'), short_pins=False, jobs=1,
+                       cache_dir=None, mcu_pattern=None, packages=None, update=False, derived=True, profile=False,
+                       shard='family', shard_size=None, pin_db=None, compact=False, signals=None):
+    """Generate the libraries of all families in source_dir into output_dir, returns the run statistics.
 
-source_filename_groups = {}
+    kinds are the library kinds written for every family, see library_kinds.
+    When only some parts are selected by mcu_pattern or packages the symbols either update the existing libraries
+    in place, or go to separate libraries with a _filtered suffix so the complete libraries are left alone.
+    With profile the run statistics get the phase times and pin counters of every source file, see
+    write_profile_report. shard and shard_size select how the parts are split into libraries, see
+    source_filename_groups. Derived symbols only extend parts of the same library. With pin_db the parts are
+    read from the compiled pin database instead of the source files in source_dir. compact writes the kicad_sym
+    libraries without indentation, see compact_sexpr. signals selects the alternate functions, see source_pin.
+    """
+    if cache_dir:
+        os.makedirs(cache_dir, exist_ok=True)
 
-for file in source_filenames:
-    m = re.match(".*/(STM32.).*.xml$", file)
-    # print("m {} {}".format(m, m.group(1)))
-    if m.group(1) not in source_filename_groups.keys():
-        source_filename_groups[m.group(1)] = [file]
-    else:
-        source_filename_groups[m.group(1)].append(file)
+    groups = source_filename_groups(source_dir, families, mcu_pattern, packages, shard, shard_size, pin_db)
+    suffix = "_filtered" if (mcu_pattern or packages) and not update else ""
 
-# print("groups {}".format(source_filename_groups))
+    pool = multiprocessing.Pool(jobs) if jobs > 1 else None
+    try:
+        # All groups are queued up front so the workers never idle between libraries, the libraries themselves
+        # are still written one after the other in the order of the groups.
+        group_symbols = {}
+        for group, source_filenames in groups.items():
+            group_symbols[group] = render_library_symbols(source_filenames, pool, jobs, kinds=kinds,
+                                                          short_pins=short_pins, packages=packages,
+                                                          cache_dir=cache_dir, profile=profile, pin_db=pin_db,
+                                                          compact=compact, signals=signals)
+
+        run_stats = new_run_stats()
+        for group, symbols in group_symbols.items():
+            library_stats = generate_library(output_dir, group, symbols, kinds, update, suffix, derived, compact)
+            update_run_stats(run_stats, library_stats)
+    finally:
+        if pool:
+            pool.terminate()
+            pool.join()
+
+    return run_stats
+
+def write_profile_report(report_filename, run_stats, seconds):
+    # A .csv report has a row per source file and the libraries go to a second _libraries.csv file next to it,
+    # any other report is a single json file. With more than one job the phase times add up to more than the run
+    # time, the workers run in parallel.
+    files = run_stats['files']
+    totals = {key: sum(record[key] for record in files) for key in profile_phases + ('total',) + profile_counters}
+    try:
+        if report_filename.lower().endswith(".csv"):
+            with open(report_filename, 'w', newline='') as f:
+                writer = csv.DictWriter(f, ['library', 'name', 'source', 'cached', *profile_phases, 'total',
+                                            *profile_counters])
+                writer.writeheader()
+                writer.writerows(files)
+            with open(os.path.splitext(report_filename)[0] + "_libraries.csv", 'w', newline='') as f:
+                writer = csv.writer(f)
+                writer.writerow(['library', 'symbols', 'bytes'])
+                for lib_name, lib in run_stats['libraries'].items():
+                    writer.writerow([lib_name, lib['symbols'], lib['bytes']])
+        else:
+            with open(report_filename, 'w') as f:
+                json.dump({'seconds': seconds, 'totals': totals, 'libraries': run_stats['libraries'],
+                           'files': files}, f, indent=2)
+    except OSError as e:
+        raise GeneratorError(f"could not write profile report '{report_filename}': {e}")
+
+    log.info(f"Profiled {len(files)} source files in {seconds:.2f}s, wrote the report to '{report_filename}'.")
+
+
+def write_lib_table(table_filename, output_dir, libraries, uri_prefix=None):
+    # Write the sym-lib-table entries of the symbol libraries in the run statistics, ready to be pasted into the
+    # table of a project or the global one. The library paths start with uri_prefix, e.g. a KiCad path variable, or
+    # with the absolute output directory.
+    if uri_prefix is None:
+        uri_prefix = os.path.abspath(output_dir)
+    lib_types = {'single': "KiCad", 'multi': "KiCad", 'legacy': "Legacy"}
+    entries = {lib_filename: lib for lib_filename, lib in libraries.items() if lib['kind'] in lib_types}
+    try:
+        with open(table_filename, 'w') as f:
+            for lib_filename, lib in entries.items():
+                # The names have to be unique in the table, the legacy library has the same name as the single one
+                lib_name = os.path.splitext(lib_filename)[0] + ("_legacy" if lib['kind'] == 'legacy' else "")
+                uri = f"{uri_prefix.rstrip('/')}/{lib_filename}"
+                descr = f"{lib['shard']} multi unit symbols" if lib['kind'] == 'multi' else f"{lib['shard']} symbols"
+                f.write(f'  (lib (name "{lib_name}")(type "{lib_types[lib["kind"]]}")(uri "{uri}")(options "")'
+                        f'(descr "{descr}"))\n')
+    except OSError as e:
+        raise GeneratorError(f"could not write library table '{table_filename}': {e}")
+
+    log.info("Wrote the library table entries of %d libraries to '%s'.", len(entries), table_filename)
+
+
+def write_diagnostics_report(report_filename, run_stats):
+    # The merged pins and unknown pin types of every part, and the totals of the run, as json
+    report = {'unknown_pin_types': dict(sorted(run_stats['unknown_pin_types'].items())),
+              'missing_glyphs': sorted(run_stats['missing_glyphs']),
+              'parts': dict(sorted(run_stats['diagnostics'].items()))}
+    try:
+        with open(report_filename, 'w') as f:
+            json.dump(report, f, indent=2)
+    except OSError as e:
+        raise GeneratorError(f"could not write diagnostics report '{report_filename}': {e}")
+
+    log.info("Wrote the merge and pin type diagnostics to '%s'.", report_filename)
+
+
+def profile_slowest_files(run_stats, count, dump_prefix, **options):
+    # Run the count slowest source files once more under cProfile, every file gets its own .prof dump that can be
+    # read with pstats or snakeviz. Files that came from the symbol cache were not generated, they are left out.
+    # The options are passed on to render_symbols.
+    files = sorted((record for record in run_stats['files'] if not record['cached']),
+                   key=lambda record: record['total'], reverse=True)
+    for record in files[:count]:
+        dump_filename = f"{dump_prefix}.{record['name']}.prof"
+        profiler = cProfile.Profile()
+        profiler.runcall(render_symbols, record['source'], **options)
+        try:
+            profiler.dump_stats(dump_filename)
+        except OSError as e:
+            raise GeneratorError(f"could not write profile dump '{dump_filename}': {e}")
+        log.info(f"Wrote the profile of {record['name']} ({record['total'] * 1000:.1f}ms) to '{dump_filename}'.")
 
-# exit(1)
+# width = graphical_text_width("PA7/ADC_IN7/12S1_SD/SPI1_MOSI/TIM14_CH1/TIM17_CH1/TIM1_CH1N/TIM3_CH2")
+# print "Test Text Width: " + str(width) + " double: " + str(width * 2) + "\n"
 
-for group, source_filenames in source_filename_groups.items():
-    generate_library(group, source_filenames, single=True)
-    generate_library(group + "_u", source_filenames, single=False)
 
+def configure_logging(level):
+    # Only the generator's own logger is set up, and on every call of main, so running main in process neither
+    # touches the root logger of the host application nor keeps the level of an earlier call
+    if not log.handlers:
+        handler = logging.StreamHandler()
+        handler.setFormatter(logging.Formatter("%(message)s"))
+        log.addHandler(handler)
+    log.setLevel(level)
+    log.propagate = False
+
+
+def main(argv=None):
+    script_dir = os.path.dirname(os.path.abspath(__file__))
+
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--source-dir', default=os.path.join(script_dir, "..", "stm32cube", "db", "mcu"),
+                        help="stm32cube mcu database directory (default: %(default)s)")
+    parser.add_argument('--output-dir', default=os.path.join(script_dir, ".."),
+                        help="directory the libraries are written to (default: %(default)s)")
+    parser.add_argument('--compile-db', metavar='FILE',
+                        help="compile the source files into the pin database FILE and exit, only the source files "
+                             "that changed since the last compile are parsed again")
+    parser.add_argument('--pin-db', metavar='FILE',
+                        help="read the parts from the pin database FILE instead of the source files, see "
+                             "--compile-db")
+    parser.add_argument('--family', action='append', metavar='LETTER',
+                        help="only generate the library of this family letter, e.g. F for STM32F, can be repeated")
+    parser.add_argument('--mcu', metavar='REGEX',
+                        help="only generate the parts whose name matches the regular expression, e.g. 'L4P5C.*U'")
+    parser.add_argument('--package', action='append',
+                        help="only generate the parts in packages starting with this name, e.g. LQFP, can be "
+                             "repeated")
+    parser.add_argument('--update', action='store_true',
+                        help="replace the selected symbols in the existing libraries instead of writing them to "
+                             "separate _filtered libraries")
+    parser.add_argument('--symbols', choices=['both', 'single', 'multi'], default='both',
+                        help="generate the single symbol libraries, the multi unit symbol libraries or both "
+                             "(default: %(default)s)")
+    parser.add_argument('--format', action='append', choices=['kicad_sym', 'legacy', 'json'],
+                        help="write kicad_sym libraries, legacy EESchema .lib libraries with the single and the multi "
+                             "unit symbols or a json pin table per line of .jsonl, can be repeated to write several "
+                             "formats in one run (default: kicad_sym)")
+    parser.add_argument('--signal', action='append', metavar='PATTERN',
+                        help="only add the alternate pin functions matching this glob pattern, e.g. 'USART*' or "
+                             "'ADC*_IN*', can be repeated")
+    parser.add_argument('--signal-file', metavar='FILE',
+                        help="only add the alternate pin functions matching the glob patterns in FILE, one per line, "
+                             "empty lines and lines starting with # are ignored")
+    parser.add_argument('--compact', action='store_true',
+                        help="write the kicad_sym libraries with a line per symbol, unit and pin and no indentation, "
+                             "smaller than the default pretty printed libraries")
+    parser.add_argument('--short-pins', action='store_true',
+                        help="do not add the alternate pin functions to the symbols")
+    parser.add_argument('--no-derived', dest='derived', action='store_false',
+                        help="write every part as a full symbol, by default parts with the same pinout as an earlier "
+                             "part are written as symbols that extend the earlier part's symbol")
+    parser.add_argument('-j', '--jobs', type=int, default=1,
+                        help="number of worker processes generating symbols, 0 uses all cpus (default: 1)")
+    parser.add_argument('--cache', metavar='DIR',
+                        help="keep the rendered symbols of every source file in DIR and only regenerate the symbols "
+                             "of source files that changed since the last run")
+    parser.add_argument('--profile', metavar='FILE',
+                        help="write the time spent reading, parsing, merging, laying out, rendering and writing every "
+                             "source file, its pin counts and the library sizes to FILE, as csv if FILE ends in .csv "
+                             "and as json otherwise")
+    parser.add_argument('--profile-top', type=int, default=0, metavar='N',
+                        help="also write a cProfile dump of the N slowest source files next to the --profile report "
+                             "(default: %(default)s)")
+    parser.add_argument('--shard', choices=sorted(shard_name_lengths), default='family',
+                        help="write a library per family (stm32f), sub family (stm32f4) or series line (stm32f405) "
+                             "(default: %(default)s)")
+    parser.add_argument('--shard-size', type=int, metavar='N',
+                        help="split libraries of more than N parts into numbered libraries of at most N parts")
+    parser.add_argument('--lib-table', metavar='FILE',
+                        help="write the sym-lib-table entries of the generated libraries to FILE")
+    parser.add_argument('--lib-table-prefix', metavar='PATH',
+                        help="start the library paths of --lib-table with PATH, e.g. '${STM32_SYMBOL_DIR}' (default: "
+                             "the absolute output directory)")
+    parser.add_argument('--diagnostics', metavar='FILE',
+                        help="write the merged pins and unknown pin types of every part to the json file FILE")
+    parser.add_argument('-v', '--verbose', action='count', default=0,
+                        help="report the progress, twice also reports every merged pin and ignored alias")
+    parser.add_argument('-q', '--quiet', action='store_true', help="only report errors")
+    args = parser.parse_args(argv)
+
+    configure_logging(logging.ERROR if args.quiet else max(logging.DEBUG, logging.WARNING - 10 * args.verbose))
+
+    if args.profile_top and not args.profile:
+        parser.error("--profile-top needs --profile")
+    if args.compile_db and args.pin_db:
+        parser.error("--compile-db and --pin-db can not be combined")
+    if args.shard_size is not None and args.shard_size < 1:
+        parser.error("--shard-size must be at least 1")
+    try:
+        mcu_pattern = re.compile(args.mcu) if args.mcu else None
+    except re.error as e:
+        parser.error(f"--mcu '{args.mcu}' is not a valid regular expression: {e}")
+
+    families = {family.upper() for family in args.family} if args.family else None
+
+    signals = list(args.signal or [])
+    if args.signal_file:
+        try:
+            with open(args.signal_file) as f:
+                file_signals = [line.strip() for line in f if line.strip() and not line.strip().startswith("#")]
+        except OSError as e:
+            parser.error(f"could not read signal file '{args.signal_file}': {e}")
+        # An empty list would keep every signal instead of none
+        if not file_signals:
+            parser.error(f"signal file '{args.signal_file}' has no signal patterns")
+        signals += file_signals
+    if signals and args.short_pins:
+        parser.error("--short-pins drops all alternate pin functions, it can not be combined with --signal")
+
+    formats = args.format or ['kicad_sym']
+    kinds = []
+    if 'kicad_sym' in formats:
+        if args.symbols in ('both', 'single'):
+            kinds.append('single')
+        if args.symbols in ('both', 'multi'):
+            kinds.append('multi')
+    if 'legacy' in formats:
+        kinds.append('legacy')
+    if 'json' in formats:
+        kinds.append('pin_table')
+    if args.update and not all(library_kinds[kind]['update'] for kind in kinds):
+        parser.error("--update only works with kicad_sym libraries")
+
+    options = {'kinds': tuple(kinds),
+               'short_pins': args.short_pins,
+               'packages': args.package,
+               'pin_db': args.pin_db,
+               'compact': args.compact,
+               'signals': tuple(signals) or None}
+
+    try:
+        if args.compile_db:
+            compile_pin_db(args.source_dir, args.compile_db, args.jobs if args.jobs > 0 else os.cpu_count())
+            return 0
+
+        start = time.perf_counter()
+        run_stats = generate_libraries(args.source_dir, args.output_dir, families,
+                                       jobs=args.jobs if args.jobs > 0 else os.cpu_count(),
+                                       cache_dir=args.cache,
+                                       mcu_pattern=mcu_pattern,
+                                       update=args.update,
+                                       derived=args.derived,
+                                       profile=bool(args.profile),
+                                       shard=args.shard,
+                                       shard_size=args.shard_size,
+                                       **options)
+        if args.lib_table:
+            write_lib_table(args.lib_table, args.output_dir, run_stats['libraries'], args.lib_table_prefix)
+        if args.profile:
+            write_profile_report(args.profile, run_stats, time.perf_counter() - start)
+            profile_slowest_files(run_stats, args.profile_top, os.path.splitext(args.profile)[0], **options)
+        if args.diagnostics:
+            write_diagnostics_report(args.diagnostics, run_stats)
+    except GeneratorError as e:
+        log.error("%s", e)
+        log.error("Exiting!")
+        return 1
+
+    report_run_stats(run_stats)
+
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
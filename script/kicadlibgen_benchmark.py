@@ -0,0 +1,250 @@
+#!/usr/bin/env python3
+"""Benchmark of the kicad library generator stages.
+
+Times the generator stage by stage over a set of source files: XML parse, pin merge, bank grouping and layout,
+text width computation and serialization, the last three for both the single symbol and the multi unit symbol.
+Every stage is also run once under tracemalloc to get its peak memory. Without --source-dir a deterministic set of
+synthetic source files is generated, so the results of different commits can be compared without the stm32cube
+database, see stm32cube_synth.py. --json saves the results, --compare shows the change against saved results.
+The pretty printed and the compact library format are also compared by the size of the library of all source files
+and the time it takes to index and parse all of its symbols.
+"""
+
+__author__ = 'esdentem'
+
+import argparse
+import json
+import os
+import glob
+import io
+import platform
+import subprocess
+import tempfile
+import time
+import tracemalloc
+
+import kicadlibgen
+import kicadlibreader
+import stm32cube_synth
+
+# Bumped whenever the synthetic fixture or what a stage measures changes, --compare refuses results of another
+# version. 2: synthetic source files from stm32cube_synth, 3: the layout stage runs symbol_layout, 4: the serialize
+# stages reuse the layouts and no longer include layout and text width, 5: the bank grouping is part of the layout,
+# 6: separate layout stages for the single and the multi unit symbol.
+benchmark_version = 6
+
+
+def benchmark_stages(source_filenames):
+    """Stage name to a function running the stage over all source files, in pipeline order.
+
+    The stages get their inputs from the previous stages outside of the timed part, every call of a stage
+    function does the complete work again. A stage function with a setup attribute is called with the result of
+    setup(), which is not timed either.
+    """
+    sources = [kicadlibgen.source_from_file(filename) for filename in source_filenames]
+    models = [kicadlibgen.mcu_model(attrib, kicadlibgen.fresh_pins(pins)) for attrib, pins in sources]
+
+    def parse():
+        for filename in source_filenames:
+            kicadlibgen.source_from_file(filename)
+
+    def merge(source_pins):
+        for pins in source_pins:
+            kicadlibgen.merge_pins(pins)
+    merge.setup = lambda: [kicadlibgen.fresh_pins(pins) for _, pins in sources]
+
+    def layout_single():
+        for mcu in models:
+            kicadlibgen.symbol_layout(mcu, single=True)
+
+    def layout_multi():
+        for mcu in models:
+            kicadlibgen.symbol_layout(mcu, single=False)
+
+    def text_width_single():
+        kicadlibgen.graphical_text_width.cache_clear()
+        for mcu in models:
+            kicadlibgen.symbol_body_width(mcu['Pins'])
+
+    def text_width_multi():
+        kicadlibgen.graphical_text_width.cache_clear()
+        for mcu in models:
+            for bank_name, bank in kicadlibgen.mcu_banks(mcu).items():
+                kicadlibgen.symbol_bank_width(bank_name, bank)
+
+    # The layouts, including the text widths, are computed before the timed part, so the serialize stages only
+    # measure writing the symbol text
+    def warm_layouts(single):
+        kicadlibgen.layout_cache_size = max(kicadlibgen.layout_cache_size, len(models))
+        kicadlibgen.layout_cache.clear()
+        for mcu in models:
+            kicadlibgen.cached_symbol_layout(mcu, single)
+        return single
+
+    def serialize(single):
+        for mcu in models:
+            kicadlibgen.render_symbol(mcu, single)
+
+    def serialize_single(single):
+        serialize(single)
+    serialize_single.setup = lambda: warm_layouts(True)
+
+    def serialize_multi(single):
+        serialize(single)
+    serialize_multi.setup = lambda: warm_layouts(False)
+
+    return {
+        'parse': parse,
+        'merge': merge,
+        'layout_single': layout_single,
+        'layout_multi': layout_multi,
+        'text_width_single': text_width_single,
+        'text_width_multi': text_width_multi,
+        'serialize_single': serialize_single,
+        'serialize_multi': serialize_multi,
+    }
+
+
+def run_stage(stage, repeat):
+    setup = getattr(stage, 'setup', None)
+    stage_args = lambda: (setup(),) if setup else ()
+
+    best = None
+    for _ in range(repeat):
+        args = stage_args()
+        start = time.perf_counter()
+        stage(*args)
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+
+    args = stage_args()
+    tracemalloc.start()
+    stage(*args)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    return {'seconds': best, 'peak_kib': peak / 1024}
+
+
+def write_library(filename, models, compact):
+    kicadlibgen.layout_cache.clear()
+    with open(filename, 'w') as f:
+        head = io.StringIO()
+        kicadlibgen.lib_head(head)
+        f.write(kicadlibgen.compact_sexpr(head.getvalue()) if compact else head.getvalue())
+        for mcu in models:
+            text = kicadlibgen.render_symbol(mcu, single=True)
+            f.write(kicadlibgen.compact_sexpr(text) if compact else text)
+        kicadlibgen.lib_foot(f)
+
+
+def load_library(filename):
+    with kicadlibreader.SymbolLibrary(filename) as lib:
+        for name in lib.names():
+            lib.symbol(name)
+
+
+def compare_formats(source_filenames, tmp_dir, repeat):
+    """Library size and load time of the single symbol library of all source files, pretty printed and compact."""
+    models = [kicadlibgen.symbols_from_file(filename) for filename in source_filenames]
+    formats = {}
+    for name, compact in (('pretty', False), ('compact', True)):
+        filename = os.path.join(tmp_dir, f"benchmark_{name}.kicad_sym")
+        write_library(filename, models, compact)
+        load_seconds = None
+        for _ in range(repeat):
+            start = time.perf_counter()
+            load_library(filename)
+            elapsed = time.perf_counter() - start
+            load_seconds = elapsed if load_seconds is None else min(load_seconds, elapsed)
+        formats[name] = {'bytes': os.path.getsize(filename), 'load_seconds': load_seconds}
+    return formats
+
+
+def git_revision():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__)), check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def print_results(results, baseline=None):
+    header = f"{'Stage':<20}{'Time ms':>12}{'Peak KiB':>12}"
+    if baseline:
+        header += f"{'Time old':>12}{'Change':>10}"
+    print(header)
+    for name, stage in results['stages'].items():
+        line = f"{name:<20}{stage['seconds'] * 1000:>12.2f}{stage['peak_kib']:>12.0f}"
+        old = baseline['stages'].get(name) if baseline else None
+        if old:
+            line += f"{old['seconds'] * 1000:>12.2f}{(stage['seconds'] / old['seconds'] - 1) * 100:>+9.1f}%"
+        print(line)
+
+    print()
+    print(f"{'Format':<20}{'KiB':>12}{'Load ms':>12}")
+    for name, library in results.get('formats', {}).items():
+        print(f"{name:<20}{library['bytes'] / 1024:>12.0f}{library['load_seconds'] * 1000:>12.2f}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--source-dir', help="benchmark the STM32*.xml files of this directory instead of "
+                                             "synthetic source files")
+    parser.add_argument('--limit', type=int, help="only use the first LIMIT source files of --source-dir")
+    parser.add_argument('--files', type=int, default=20,
+                        help="number of synthetic source files (default: %(default)s)")
+    parser.add_argument('--pins', type=int, default=176,
+                        help="pins per synthetic source file (default: %(default)s)")
+    parser.add_argument('--signals', type=int, default=12,
+                        help="alternate functions per synthetic port pin (default: %(default)s)")
+    parser.add_argument('--scale', type=int, default=1,
+                        help="multiply the synthetic pins and alternate functions, run with growing scales to get "
+                             "the scaling curve (default: %(default)s)")
+    parser.add_argument('--seed', type=int, default=1, help="synthetic source file seed (default: %(default)s)")
+    parser.add_argument('--repeat', type=int, default=5,
+                        help="timed runs per stage, the fastest one is reported (default: %(default)s)")
+    parser.add_argument('--json', metavar='FILE', help="save the results to FILE")
+    parser.add_argument('--compare', metavar='FILE', help="compare against results saved with --json")
+    args = parser.parse_args()
+
+    baseline = None
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        # Results saved before the version was recorded are version 1
+        if baseline.get('version', 1) != benchmark_version:
+            parser.error(f"'{args.compare}' was measured by benchmark version {baseline.get('version', 1)}, this is "
+                         f"version {benchmark_version}, the stages can not be compared")
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        if args.source_dir:
+            source_filenames = sorted(glob.glob(os.path.join(args.source_dir, "STM32*.xml")))[:args.limit]
+            fixture = {'source_dir': args.source_dir, 'files': len(source_filenames)}
+        else:
+            source_filenames = stm32cube_synth.write_corpus(tmp_dir, families="F", parts=args.files,
+                                                            pins=(args.pins * args.scale,),
+                                                            signals=args.signals * args.scale, seed=args.seed)
+            fixture = {'files': args.files, 'pins': args.pins * args.scale, 'signals': args.signals * args.scale,
+                       'seed': args.seed}
+        if not source_filenames:
+            parser.error(f"no source files found in '{args.source_dir}'")
+        if baseline and baseline['fixture'] != fixture:
+            parser.error(f"'{args.compare}' was measured on the fixture {baseline['fixture']}, not on {fixture}")
+
+        stages = benchmark_stages(source_filenames)
+        results = {
+            'version': benchmark_version,
+            'revision': git_revision(),
+            'python': platform.python_version(),
+            'fixture': fixture,
+            'repeat': args.repeat,
+            'stages': {name: run_stage(stage, args.repeat) for name, stage in stages.items()},
+            'formats': compare_formats(source_filenames, tmp_dir, args.repeat),
+        }
+
+    print_results(results, baseline)
+
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(results, f, indent=2)
@@ -0,0 +1,173 @@
+#!/usr/bin/env python3
+"""Indexed reader for kicad_symbol_lib files.
+
+One streaming pass over the library finds the byte range of every top level (symbol "...") block, the symbols
+themselves are only read and parsed when they are asked for. The file is memory mapped, so loading a single symbol
+touches only its own pages. The scan follows the S-expression structure, not the line layout, any mix of tabs,
+spaces and newlines works.
+"""
+
+__author__ = 'esdentem'
+
+import argparse
+import mmap
+import re
+import sys
+
+# A quoted string including its escapes, or a single parenthesis
+token_re = re.compile(rb'"(?:[^"\\]|\\.)*"|[()]')
+# The start of a symbol block and its name
+symbol_head_re = re.compile(rb'\(\s*symbol\s+"((?:[^"\\]|\\.)*)"')
+# The tokens of an S-expression: parentheses, quoted strings and bare atoms
+sexpr_token_re = re.compile(r'\s*(?:(\()|(\))|"((?:[^"\\]|\\.)*)"|([^\s()"]+))')
+
+
+def unescape(text):
+    return re.sub(r'\\(.)', r'\1', text)
+
+
+def parse_sexpr(text):
+    """Parse the S-expression text into nested lists, quoted strings and bare atoms both become str."""
+    stack = [[]]
+    pos = 0
+    end = len(text)
+    while pos < end:
+        m = sexpr_token_re.match(text, pos)
+        if not m:
+            if text[pos:].strip():
+                raise ValueError(f"unexpected character at offset {pos}")
+            break
+        pos = m.end()
+        if m.group(1):
+            stack.append([])
+        elif m.group(2):
+            if len(stack) < 2:
+                raise ValueError(f"unbalanced ')' at offset {pos - 1}")
+            expr = stack.pop()
+            stack[-1].append(expr)
+        elif m.group(3) is not None:
+            stack[-1].append(unescape(m.group(3)))
+        else:
+            stack[-1].append(m.group(4))
+
+    if len(stack) != 1:
+        raise ValueError("unbalanced '(' at end of input")
+    return stack[0][0] if len(stack[0]) == 1 else stack[0]
+
+
+def sexpr_children(expr, key):
+    """All sub expressions of expr that start with key."""
+    return [child for child in expr if isinstance(child, list) and child and child[0] == key]
+
+
+def sexpr_child(expr, key, default=None):
+    """The first sub expression of expr that starts with key."""
+    for child in expr:
+        if isinstance(child, list) and child and child[0] == key:
+            return child
+    return default
+
+
+class SymbolLibrary:
+    """Lazily loaded kicad_symbol_lib file, indexed by top level symbol name.
+
+    >>> with SymbolLibrary("stm32f.kicad_sym") as lib:
+    ...     text = lib.text("STM32F030C6Tx")
+    """
+
+    def __init__(self, filename):
+        self.filename = filename
+        self.index = {}
+        self._file = open(filename, 'rb')
+        try:
+            self._map = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        except ValueError:
+            # Empty files can not be mapped
+            self._file.close()
+            raise ValueError(f"'{filename}' is empty")
+        self._scan()
+
+    def _scan(self):
+        data = self._map
+        depth = 0
+        start = None
+        for m in token_re.finditer(data):
+            token = m.group()
+            if token == b'(':
+                depth += 1
+                # Depth 1 is the kicad_symbol_lib itself, its direct children are the library symbols
+                if depth == 2:
+                    head = symbol_head_re.match(data, m.start())
+                    start = m.start() if head else None
+                    name = unescape(head.group(1).decode()) if head else None
+            elif token == b')':
+                if depth == 2 and start is not None:
+                    self.index[name] = (start, m.end())
+                    start = None
+                depth -= 1
+                if depth < 0:
+                    raise ValueError(f"'{self.filename}' has an unbalanced ')' at offset {m.start()}")
+
+        if depth != 0:
+            raise ValueError(f"'{self.filename}' is truncated, {depth} expressions are not closed")
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def close(self):
+        self._map.close()
+        self._file.close()
+
+    def __contains__(self, name):
+        return name in self.index
+
+    def __len__(self):
+        return len(self.index)
+
+    def names(self):
+        """Symbol names in library order."""
+        return list(self.index)
+
+    def raw(self, name):
+        start, end = self.index[name]
+        return self._map[start:end]
+
+    def text(self, name):
+        """Text of the symbol block exactly as it is in the file."""
+        return self.raw(name).decode()
+
+    def symbol(self, name):
+        """The symbol parsed into nested lists, see parse_sexpr."""
+        return parse_sexpr(self.text(name))
+
+    def extends(self, name):
+        """Name of the parent symbol of a derived symbol, None for full symbols."""
+        m = re.match(rb'\(\s*symbol\s+"(?:[^"\\]|\\.)*"\s*\(\s*extends\s+"((?:[^"\\]|\\.)*)"', self.raw(name))
+        return unescape(m.group(1).decode()) if m else None
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('library', help="kicad_sym library file")
+    parser.add_argument('names', nargs='*', help="print the text of these symbols, lists all symbols if omitted")
+    args = parser.parse_args()
+
+    try:
+        lib = SymbolLibrary(args.library)
+    except (OSError, ValueError) as e:
+        print(e, file=sys.stderr)
+        sys.exit(1)
+
+    with lib:
+        if not args.names:
+            for name, (start, end) in lib.index.items():
+                parent = lib.extends(name)
+                print(f"{name}\t{start}\t{end - start}" + (f"\textends {parent}" if parent else ""))
+        for name in args.names:
+            if name not in lib:
+                print(f"no symbol '{name}' in '{args.library}'", file=sys.stderr)
+                sys.exit(1)
+            print(lib.text(name))
@@ -0,0 +1,93 @@
+#!/usr/bin/env python3
+"""Micro benchmark of the pin merge step of the kicad library generator.
+
+Compares the indexed pin table of kicadlibgen.pin_append_combine against the linear scan merge it replaced. By
+default the largest STM32H7 and STM32N6 source files of the stm32cube database are used, other source files can be
+given on the command line.
+"""
+
+__author__ = 'esdentem'
+
+import argparse
+import glob
+import os
+import timeit
+
+import kicadlibgen
+
+
+def pin_append_combine_linear(pin_list, new_pin):
+    # The previous merge implementation, a linear search for the pin and a linear search for every function
+    pin = None
+    pin_index = 0
+    for p in pin_list:
+        if p.number == new_pin.number:
+            pin = p
+            break
+        pin_index += 1
+
+    if pin:
+        if pin.name != new_pin.name:
+            pin.functions.append(new_pin.name)
+        for function in new_pin.functions:
+            if function not in pin.functions:
+                pin.functions.append(function)
+        if pin.io_type != new_pin.io_type:
+            pin.io_type = "I/O"
+        pin_list[pin_index] = pin
+    else:
+        pin_list.append(new_pin)
+
+
+def merge_pins_linear(pins):
+    pin_list = []
+    for pin in pins:
+        pin_append_combine_linear(pin_list, pin)
+    return pin_list
+
+
+def largest_source_files(source_dir, patterns, count):
+    filenames = []
+    for pattern in patterns:
+        matches = glob.glob(os.path.join(source_dir, pattern))
+        filenames += sorted(matches, key=os.path.getsize, reverse=True)[:count]
+    return filenames
+
+
+def benchmark_file(source_filename, repeat):
+    _, pins = kicadlibgen.source_from_file(source_filename)
+
+    results = {}
+    if merge_pins_linear(kicadlibgen.fresh_pins(pins)) != kicadlibgen.merge_pins(kicadlibgen.fresh_pins(pins)):
+        raise RuntimeError(f"merge results differ for '{source_filename}'")
+
+    for name, merge in (('linear', merge_pins_linear), ('indexed', kicadlibgen.merge_pins)):
+        runs = [kicadlibgen.fresh_pins(pins) for _ in range(repeat)]
+        results[name] = min(timeit.repeat(lambda: merge(runs.pop()), number=1, repeat=repeat))
+
+    return len(pins), results
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('sources', nargs='*', help="source files to benchmark")
+    parser.add_argument('--source-dir',
+                        default=os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "stm32cube", "db", "mcu"),
+                        help="stm32cube mcu database directory (default: %(default)s)")
+    parser.add_argument('--count', type=int, default=3,
+                        help="number of the largest STM32H7 and STM32N6 files to use (default: %(default)s)")
+    parser.add_argument('--repeat', type=int, default=20,
+                        help="number of timed runs per file, the fastest one is reported (default: %(default)s)")
+    args = parser.parse_args()
+
+    source_filenames = args.sources or largest_source_files(args.source_dir, ["STM32H7*.xml", "STM32N6*.xml"],
+                                                            args.count)
+    if not source_filenames:
+        parser.error(f"no source files found in '{args.source_dir}'")
+
+    print(f"{'File':<32}{'Pins':>8}{'Linear ms':>12}{'Indexed ms':>12}{'Speedup':>10}")
+    for source_filename in source_filenames:
+        pin_count, results = benchmark_file(source_filename, args.repeat)
+        print(f"{os.path.basename(source_filename):<32}{pin_count:>8}"
+              f"{results['linear'] * 1000:>12.3f}{results['indexed'] * 1000:>12.3f}"
+              f"{results['linear'] / results['indexed']:>9.1f}x")
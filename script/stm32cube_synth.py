@@ -0,0 +1,183 @@
+#!/usr/bin/env python3
+"""Synthetic stm32cube database generator.
+
+Writes STM32*.xml files in the layout of the stm32cube mcu database, sized by the command line instead of by the
+parts ST sells: pin count, number of ports, alternate functions per pin, pins sharing a position (which the
+generator has to merge) and QFPN packages with or without a power pad. The files let the library generator be
+tested and timed without a database checkout, and at sizes well beyond the current parts.
+"""
+
+__author__ = 'esdentem'
+
+import argparse
+import math
+import os
+import random
+
+# Package name to the package code letter of the part number, see kicadlibgen.package_code_letters
+package_letters = {'LQFP': 'T', 'UFQFPN': 'U', 'TSSOP': 'P', 'WLCSP': 'Y', 'TFBGA': 'H', 'UFBGA': 'K'}
+
+# Pin count code letters of the part number
+pin_count_letters = [(20, 'F'), (28, 'G'), (32, 'K'), (36, 'T'), (48, 'C'), (64, 'R'), (100, 'V'), (144, 'Z'),
+                     (169, 'A'), (176, 'I'), (208, 'B'), (216, 'N')]
+
+flash_letters = "468BCEGHI"
+
+# BGA rows skip the letters that are easily mistaken for digits
+ball_rows = "ABCDEFGHJKLMNPRTUVWY"
+
+peripheral_signals = [
+    "ADC{}_IN{}", "ADC{}_INP{}", "DAC{}_OUT{}", "COMP{}_INP", "TIM{}_CH{}", "TIM{}_CH{}N", "TIM{}_BKIN",
+    "USART{}_TX", "USART{}_RX", "USART{}_CTS", "USART{}_RTS", "UART{}_TX", "UART{}_RX", "LPUART{}_TX",
+    "SPI{}_MOSI", "SPI{}_MISO", "SPI{}_SCK", "SPI{}_NSS", "I2C{}_SDA", "I2C{}_SCL", "I2S{}_WS", "I2S{}_CK",
+    "FDCAN{}_RX", "FDCAN{}_TX", "SAI{}_SD_A", "SAI{}_MCLK_B", "LTDC_G{}", "LTDC_B{}", "FMC_D{}", "FMC_A{}",
+    "SDMMC{}_D{}", "OCTOSPI{}_IO{}", "ETH_RMII_TXD{}", "USB_OTG_HS_ULPI_D{}", "DCMI_D{}", "EVENTOUT",
+]
+
+power_pin_names = ["VDD", "VSS", "VDDA", "VSSA", "VDD", "VSS", "VDDIO2", "VDD_USB", "VREF+"]
+other_pins = [("NRST", "Reset"), ("BOOT0", "Boot"), ("VBAT", "Power"), ("VCAP", "Power"), ("PDR_ON", "Reset"),
+              ("OSC_IN", "I"), ("NC", "NC")]
+
+
+def ball_names(count):
+    # Ball names of a square grid big enough for count balls, A1 A2 ... then B1 ..., rows past Y get two letters
+    columns = math.ceil(math.sqrt(count))
+    rows = list(ball_rows) + [a + b for a in ball_rows for b in ball_rows]
+    return [f"{rows[i // columns]}{i % columns + 1}" for i in range(count)]
+
+
+def part_name(family, series, pin_count, flash, package):
+    pin_letter = min(pin_count_letters, key=lambda entry: abs(entry[0] - pin_count))[1]
+    return f"STM32{family}{series}{pin_letter}{flash}{package_letters[package]}x"
+
+
+def signal_name(rng):
+    template = rng.choice(peripheral_signals)
+    return template.format(*(rng.randint(1, 8) for _ in range(template.count("{}"))))
+
+
+def mcu_xml(ref_name, family, package, pin_count, ports, signals_per_pin, duplicates, power_pad, rng):
+    """Source file text of one part, pins are numbered for leaded and QFN packages and balls for BGA and CSP."""
+    if package in ('TFBGA', 'UFBGA', 'WLCSP'):
+        positions = ball_names(pin_count)
+    else:
+        positions = [str(i + 1) for i in range(pin_count)]
+
+    lines = ['<?xml version="1.0" encoding="UTF-8" standalone="no"?>',
+             f'<Mcu ClockTree="STM32{family}" DBVersion="V3.0" Family="STM32{family}{ref_name[6]}" '
+             f'HasPowerPad="{"true" if power_pad else "false"}" IOType="" Line="STM32{family}{ref_name[6:9]} Line" '
+             f'Package="{package}{pin_count}" RefName="{ref_name}" '
+             f'xmlns="http://mcd.rou.st.com/modules.php?name=mcu">',
+             '\t<Core>Arm Cortex-M33</Core>',
+             '\t<Frequency>160</Frequency>',
+             '\t<Ram>256</Ram>',
+             '\t<Flash>1024</Flash>',
+             '\t<Voltage Max="3.6" Min="1.71"/>',
+             '\t<IP InstanceName="ADC1" Name="ADC" Version="aditf5_v3_0_Cube"/>',
+             '\t<IP InstanceName="GPIO" Name="GPIO" Version="STM32U5_gpio_v1_0"/>',
+             '\t<IP InstanceName="USART1" Name="USART" Version="sci3_v2_1_Cube"/>']
+
+    port_letters = [chr(ord('A') + i) for i in range(ports)]
+    port_pins = {port: 0 for port in port_letters}
+
+    def port_pin(pin_type="I/O"):
+        port = rng.choice(port_letters)
+        name = f"P{port}{port_pins[port]}"
+        port_pins[port] += 1
+        pin_lines = [f'\t<Pin Name="{name}" Position="{position}" Type="{pin_type}">']
+        for signal in sorted({signal_name(rng) for _ in range(signals_per_pin)}):
+            pin_lines.append(f'\t\t<Signal Name="{signal}"/>')
+        pin_lines.append('\t\t<Signal IOModes="Input,Output,Analog,EVENTOUT,EXTI" Name="GPIO"/>')
+        pin_lines.append('\t</Pin>')
+        return pin_lines
+
+    for position in positions:
+        kind = rng.random()
+        if kind < 0.12:
+            lines.append(f'\t<Pin Name="{rng.choice(power_pin_names)}" Position="{position}" Type="Power"/>')
+        elif kind < 0.16:
+            name, pin_type = rng.choice(other_pins)
+            lines.append(f'\t<Pin Name="{name}" Position="{position}" Type="{pin_type}"/>')
+        else:
+            lines += port_pin()
+            if rng.random() < duplicates:
+                # A second die pad bonded to the same pin, the library generator merges the two
+                lines += port_pin(rng.choice(["I/O", "I/O", "MonoIO"]))
+
+    lines.append('</Mcu>')
+    return "\n".join(lines) + "\n"
+
+
+def write_corpus(output_dir, families="CFHLNUW", parts=4, variants=1, pins=(48, 64, 100, 144, 176),
+                 packages=('LQFP', 'UFQFPN', 'UFBGA', 'WLCSP'), ports=None, signals=12, duplicates=0.03,
+                 power_pad=0.5, seed=1):
+    """Write the synthetic source files to output_dir and return their filenames.
+
+    Every family gets parts parts, every part variants flash size variants with the same pinout. The pin count,
+    package and power pad of a part are picked from pins, packages and the power_pad probability, ports defaults to
+    one port per 16 pins. duplicates is the probability of a port pin having a second pad on the same position.
+    """
+    rng = random.Random(seed)
+    os.makedirs(output_dir, exist_ok=True)
+
+    filenames = []
+    for family in families:
+        for part in range(parts):
+            pin_count = rng.choice(pins)
+            package = rng.choice(packages)
+            part_ports = ports or min(26, max(2, pin_count // 16))
+            has_power_pad = package == 'UFQFPN' and rng.random() < power_pad
+            series = f"{part % 1000:03d}"
+            # All flash variants share the pinout, they are generated from the same random state
+            state = rng.getstate()
+            for flash in flash_letters[:variants]:
+                rng.setstate(state)
+                ref_name = part_name(family, series, pin_count, flash, package)
+                text = mcu_xml(ref_name, family, package, pin_count, part_ports, signals, duplicates,
+                               has_power_pad, rng)
+                filename = os.path.join(output_dir, ref_name + ".xml")
+                with open(filename, 'w') as f:
+                    f.write(text)
+                filenames.append(filename)
+
+    return sorted(filenames)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('output_dir', help="directory the STM32*.xml files are written to")
+    parser.add_argument('--families', default="CFHLNUW",
+                        help="family letters to generate parts for (default: %(default)s)")
+    parser.add_argument('--parts', type=int, default=4, help="parts per family (default: %(default)s)")
+    parser.add_argument('--variants', type=int, default=1,
+                        help="flash size variants with an identical pinout per part (default: %(default)s)")
+    parser.add_argument('--pins', type=int, action='append',
+                        help="pin count, can be repeated, every part picks one (default: 48 64 100 144 176)")
+    parser.add_argument('--package', action='append', choices=sorted(package_letters),
+                        help="package, can be repeated, every part picks one (default: LQFP UFQFPN UFBGA WLCSP)")
+    parser.add_argument('--ports', type=int,
+                        help="number of GPIO ports, at most 26 (default: one port per 16 pins)")
+    parser.add_argument('--signals', type=int, default=12,
+                        help="alternate functions drawn per port pin (default: %(default)s)")
+    parser.add_argument('--duplicates', type=float, default=0.03,
+                        help="probability of a port pin sharing its position with a second pad (default: "
+                             "%(default)s)")
+    parser.add_argument('--power-pad', type=float, default=0.5,
+                        help="probability of a QFPN part having a power pad (default: %(default)s)")
+    parser.add_argument('--scale', type=int, default=1,
+                        help="multiply the pin counts and alternate functions, e.g. 10 for parts ten times the "
+                             "current size (default: %(default)s)")
+    parser.add_argument('--seed', type=int, default=1, help="random seed (default: %(default)s)")
+    args = parser.parse_args()
+
+    if args.ports is not None and not 2 <= args.ports <= 26:
+        parser.error("--ports must be between 2 and 26")
+    if args.variants > len(flash_letters):
+        parser.error(f"--variants can be at most {len(flash_letters)}")
+
+    pins = [count * args.scale for count in (args.pins or [48, 64, 100, 144, 176])]
+    filenames = write_corpus(args.output_dir, args.families.upper(), args.parts, args.variants, pins,
+                             args.package or ['LQFP', 'UFQFPN', 'UFBGA', 'WLCSP'], args.ports,
+                             args.signals * args.scale, args.duplicates, args.power_pad, args.seed)
+
+    print(f"Wrote {len(filenames)} source files to '{args.output_dir}'.")
@@ -0,0 +1,274 @@
+#!/usr/bin/env python3
+"""Compiled pin database of the stm32cube mcu database.
+
+A single SQLite file with the merged pin model of every part: its name, package and power pad, and its pins with
+their number, name, io type and alternate functions. Pin and signal names are stored once in a string table. The
+parts are indexed by family, sub family, series line and package, the pins by signal name. kicadlibgen.py compiles
+the database with --compile-db, only the source files that changed since the last compile are parsed again, and
+reads its parts from it with --pin-db.
+
+Run with a database file to list its parts, --part NAME prints the pin table of a part. --signal answers which parts
+have a signal on which pin, e.g. --signal FDCAN1_RX --package LQFP64 --pin 'PA*' for the LQFP64 parts with FDCAN1_RX
+on a port A pin, and --same-pinout NAME lists the parts with exactly the pins of part NAME.
+"""
+
+__author__ = 'esdentem'
+
+import argparse
+import hashlib
+import json
+import os
+import sqlite3
+import sys
+
+# Bumped whenever the tables change, older databases are rebuilt from scratch
+schema_version = 2
+
+schema = """
+CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT NOT NULL);
+CREATE TABLE IF NOT EXISTS names (id INTEGER PRIMARY KEY, name TEXT NOT NULL UNIQUE);
+CREATE TABLE IF NOT EXISTS parts (
+    id INTEGER PRIMARY KEY,
+    name TEXT NOT NULL UNIQUE,
+    family TEXT NOT NULL,
+    subfamily TEXT NOT NULL,
+    line TEXT NOT NULL,
+    package TEXT NOT NULL,
+    has_power_pad TEXT NOT NULL,
+    source TEXT NOT NULL,
+    source_digest TEXT NOT NULL,
+    source_size INTEGER NOT NULL,
+    source_mtime INTEGER NOT NULL,
+    source_pins INTEGER NOT NULL,
+    merges TEXT NOT NULL,
+    pinout TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS pins (
+    part_id INTEGER NOT NULL REFERENCES parts(id) ON DELETE CASCADE,
+    seq INTEGER NOT NULL,
+    number TEXT NOT NULL,
+    name_id INTEGER NOT NULL REFERENCES names(id),
+    io_type TEXT NOT NULL,
+    PRIMARY KEY (part_id, seq)
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS pin_functions (
+    part_id INTEGER NOT NULL REFERENCES parts(id) ON DELETE CASCADE,
+    pin_seq INTEGER NOT NULL,
+    seq INTEGER NOT NULL,
+    name_id INTEGER NOT NULL REFERENCES names(id),
+    merged_pin INTEGER NOT NULL,
+    PRIMARY KEY (part_id, pin_seq, seq)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS parts_family ON parts(family);
+CREATE INDEX IF NOT EXISTS parts_subfamily ON parts(subfamily);
+CREATE INDEX IF NOT EXISTS parts_line ON parts(line);
+CREATE INDEX IF NOT EXISTS parts_package ON parts(package);
+CREATE INDEX IF NOT EXISTS parts_pinout ON parts(pinout);
+CREATE INDEX IF NOT EXISTS pins_name ON pins(name_id);
+CREATE INDEX IF NOT EXISTS pin_functions_name ON pin_functions(name_id);
+"""
+
+
+def connect(filename, create=False):
+    """Open the database, with create a missing or outdated database is created empty.
+
+    Raises FileNotFoundError if the database does not exist and ValueError if it has another schema version.
+    """
+    if not create and not os.path.exists(filename):
+        raise FileNotFoundError(f"pin database '{filename}' does not exist")
+    conn = sqlite3.connect(filename)
+    conn.execute("PRAGMA foreign_keys = ON")
+    version = conn.execute("PRAGMA user_version").fetchone()[0]
+    if version != schema_version:
+        if not create and version:
+            conn.close()
+            raise ValueError(f"pin database '{filename}' has schema version {version} instead of {schema_version}")
+        conn.executescript("DROP TABLE IF EXISTS pin_functions; DROP TABLE IF EXISTS pins; "
+                           "DROP TABLE IF EXISTS parts; DROP TABLE IF EXISTS names; DROP TABLE IF EXISTS meta;")
+        conn.execute(f"PRAGMA user_version = {schema_version}")
+    conn.executescript(schema)
+    return conn
+
+
+def get_meta(conn, key, default=None):
+    row = conn.execute("SELECT value FROM meta WHERE key = ?", (key,)).fetchone()
+    return row[0] if row else default
+
+
+def set_meta(conn, key, value):
+    conn.execute("INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?)", (key, value))
+
+
+def name_id(conn, name, name_ids):
+    # name_ids caches the ids of the names already looked up, most names repeat in every part
+    if name in name_ids:
+        return name_ids[name]
+    conn.execute("INSERT OR IGNORE INTO names (name) VALUES (?)", (name,))
+    name_ids[name] = conn.execute("SELECT id FROM names WHERE name = ?", (name,)).fetchone()[0]
+    return name_ids[name]
+
+
+def source_states(conn):
+    """Source filename to the size and modification time it had when its part was stored."""
+    return {source: (size, mtime) for source, size, mtime in
+            conn.execute("SELECT source, source_size, source_mtime FROM parts")}
+
+
+def pinout_digest(pins):
+    # Parts with the same pins, names, types and functions have the same digest
+    return hashlib.sha256(json.dumps(pins).encode()).hexdigest()
+
+
+def store_part(conn, part, name_ids):
+    """Store a part, replacing a stored part of the same name.
+
+    part has the keys of load_part. Every pin is a (number, name, functions, io_type) tuple and every function a
+    (name, merged_pin) tuple, merged_pin is true for the names of pins that were merged into the pin.
+    """
+    name = part['name']
+    conn.execute("DELETE FROM parts WHERE name = ?", (name,))
+    cursor = conn.execute(
+        "INSERT INTO parts (name, family, subfamily, line, package, has_power_pad, source, source_digest, "
+        "source_size, source_mtime, source_pins, merges, pinout) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+        (name, name[:6], name[:7], name[:9], part['package'], part['has_power_pad'], part['source'],
+         part['source_digest'], part['source_size'], part['source_mtime'], part['source_pins'],
+         json.dumps(part['merges']), pinout_digest(part['pins'])))
+    part_id = cursor.lastrowid
+    conn.executemany("INSERT INTO pins (part_id, seq, number, name_id, io_type) VALUES (?, ?, ?, ?, ?)",
+                     [(part_id, seq, number, name_id(conn, pin_name, name_ids), io_type)
+                      for seq, (number, pin_name, _, io_type) in enumerate(part['pins'])])
+    conn.executemany("INSERT INTO pin_functions (part_id, pin_seq, seq, name_id, merged_pin) VALUES (?, ?, ?, ?, ?)",
+                     [(part_id, pin_seq, seq, name_id(conn, function, name_ids), int(merged_pin))
+                      for pin_seq, (_, _, functions, _) in enumerate(part['pins'])
+                      for seq, (function, merged_pin) in enumerate(functions)])
+
+
+def remove_sources(conn, sources):
+    conn.executemany("DELETE FROM parts WHERE source = ?", [(source,) for source in sources])
+
+
+def load_part(conn, name):
+    """The stored part, see store_part, or None if there is no part of that name."""
+    row = conn.execute("SELECT id, package, has_power_pad, source, source_digest, source_size, source_mtime, "
+                       "source_pins, merges FROM parts WHERE name = ?", (name,)).fetchone()
+    if row is None:
+        return None
+    part_id, package, has_power_pad, source, digest, size, mtime, source_pins, merges = row
+
+    pins = [(number, pin_name, [], io_type) for number, pin_name, io_type in conn.execute(
+        "SELECT number, name, io_type FROM pins JOIN names ON names.id = name_id WHERE part_id = ? ORDER BY seq",
+        (part_id,))]
+    for pin_seq, function, merged_pin in conn.execute(
+            "SELECT pin_seq, name, merged_pin FROM pin_functions JOIN names ON names.id = name_id "
+            "WHERE part_id = ? ORDER BY pin_seq, seq", (part_id,)):
+        pins[pin_seq][2].append((function, bool(merged_pin)))
+
+    return {'name': name, 'package': package, 'has_power_pad': has_power_pad, 'source': source,
+            'source_digest': digest, 'source_size': size, 'source_mtime': mtime, 'source_pins': source_pins,
+            'merges': json.loads(merges), 'pins': pins}
+
+
+def part_conditions(families=None, packages=None):
+    # SQL conditions on the parts table and their arguments, see part_names
+    conditions = []
+    args = []
+    if families:
+        conditions.append(f"parts.family IN ({', '.join('?' * len(families))})")
+        args += ["STM32" + family.upper() for family in families]
+    if packages:
+        conditions.append("(" + " OR ".join("parts.package GLOB ?" for _ in packages) + ")")
+        args += [package + "*" for package in packages]
+    return conditions, args
+
+
+def part_names(conn, families=None, packages=None):
+    """Names of the parts, optionally only those of the family letters and packages starting with the names."""
+    conditions, args = part_conditions(families, packages)
+    query = "SELECT name FROM parts"
+    if conditions:
+        query += " WHERE " + " AND ".join(conditions)
+    return [name for name, in conn.execute(query + " ORDER BY name", args)]
+
+
+def find_signal(conn, signal, pin=None, families=None, packages=None):
+    """(part, pin number, pin name, signal) of every pin that has a signal matching the glob pattern signal.
+
+    The pin names themselves count as signals too, pin restricts the pins to those whose name matches the glob
+    pattern, e.g. 'PA*' for the pins of port A. families and packages select the parts like part_names.
+    """
+    conditions, args = part_conditions(families, packages)
+    if pin:
+        conditions.append("pin_names.name GLOB ?")
+        args.append(pin)
+    where = "".join(" AND " + condition for condition in conditions)
+
+    # Both halves look the signal up in the names table and use the name indexes of pins and pin_functions
+    query = ("SELECT parts.name, pins.seq, pins.number, pin_names.name, signals.name FROM names AS signals "
+             "JOIN pin_functions ON pin_functions.name_id = signals.id "
+             "JOIN pins ON pins.part_id = pin_functions.part_id AND pins.seq = pin_functions.pin_seq "
+             "JOIN names AS pin_names ON pin_names.id = pins.name_id "
+             "JOIN parts ON parts.id = pins.part_id "
+             "WHERE signals.name GLOB ?" + where +
+             " UNION "
+             "SELECT parts.name, pins.seq, pins.number, pin_names.name, pin_names.name FROM names AS pin_names "
+             "JOIN pins ON pins.name_id = pin_names.id "
+             "JOIN parts ON parts.id = pins.part_id "
+             "WHERE pin_names.name GLOB ?" + where +
+             " ORDER BY 1, 2, 5")
+    return [(part, number, pin_name, signal_name) for part, _, number, pin_name, signal_name in
+            conn.execute(query, [signal] + args + [signal] + args)]
+
+
+def same_pinout(conn, name):
+    """Names of the other parts with exactly the pins of part name, None if there is no part of that name."""
+    row = conn.execute("SELECT pinout FROM parts WHERE name = ?", (name,)).fetchone()
+    if row is None:
+        return None
+    return [other for other, in conn.execute("SELECT name FROM parts WHERE pinout = ? AND name != ? ORDER BY name",
+                                             (row[0], name))]
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('db', help="pin database file, see kicadlibgen.py --compile-db")
+    parser.add_argument('--family', action='append', metavar='LETTER', help="only list parts of this family letter")
+    parser.add_argument('--package', action='append', help="only list parts in packages starting with this name")
+    parser.add_argument('--part', metavar='NAME', help="print the pin table of this part")
+    parser.add_argument('--signal', metavar='PATTERN',
+                        help="print the part, pin number, pin name and signal of every pin with a signal matching "
+                             "the glob pattern, e.g. 'FDCAN1_RX' or 'SPI?_SCK'")
+    parser.add_argument('--pin', metavar='PATTERN',
+                        help="only print --signal pins whose name matches the glob pattern, e.g. 'PA*'")
+    parser.add_argument('--same-pinout', metavar='NAME', help="list the parts with exactly the pins of this part")
+    args = parser.parse_args()
+
+    try:
+        conn = connect(args.db)
+    except (OSError, ValueError, sqlite3.Error) as e:
+        print(e, file=sys.stderr)
+        sys.exit(1)
+
+    if args.pin and not args.signal:
+        parser.error("--pin needs --signal")
+
+    if args.signal:
+        for row in find_signal(conn, args.signal, args.pin, args.family, args.package):
+            print("\t".join(row))
+    elif args.same_pinout:
+        names = same_pinout(conn, args.same_pinout)
+        if names is None:
+            print(f"no part '{args.same_pinout}' in '{args.db}'", file=sys.stderr)
+            sys.exit(1)
+        for name in names:
+            print(name)
+    elif args.part:
+        part = load_part(conn, args.part)
+        if part is None:
+            print(f"no part '{args.part}' in '{args.db}'", file=sys.stderr)
+            sys.exit(1)
+        print(f"{part['name']}\t{part['package']}\t{part['source']}")
+        for number, pin_name, functions, io_type in part['pins']:
+            print(f"{number}\t{pin_name}\t{io_type}\t{' '.join(function for function, _ in functions)}")
+    else:
+        for name in part_names(conn, args.family, args.package):
+            print(name)